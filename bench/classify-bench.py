@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# NOTE: Compare classifying the policies, teams and roles of a batch purge with
+#       the sets of the removed users rebuilt in every iteration, as planPurge
+#       used to do, with the PurgeScope computed once, on a synthetic tenant
+#       held in memory. No request is sent.
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lib.graph import TenantGraph
+from lib.plan import PurgeScope
+from lib.plan import classifyPurge
+from lib.plan import uniqueList
+from lib.records import User
+
+
+def syntheticTenant(policyCount, userCount):
+  """
+  One app per policy, every policy has two rules over three roles, every user
+  has one team and two roles.
+  """
+  roleCount = max(policyCount // 5, 3)
+  roleIds = [f'role-{i}' for i in range(roleCount)]
+  users = [{'id': f'user{i}@example.com', 'email': f'user{i}@example.com', 'teamIds': [f'team-{i}'], 'accessRoleIds': [roleIds[i % roleCount], roleIds[(i + 1) % roleCount]]} for i in range(userCount)]
+  policies = [
+    {
+      'id': f'policy-{i}',
+      'rules': [
+        {'accessRoleIds': [roleIds[i % roleCount], roleIds[(i + 1) % roleCount]]},
+        {'accessRoleIds': [roleIds[(i + 2) % roleCount]]},
+      ],
+    }
+    for i in range(policyCount)
+  ]
+  apps = [{'id': f'app-{i}', 'policyId': f'policy-{i}'} for i in range(policyCount)]
+  teams = [{'id': f'team-{i}', 'emails': [f'user{i}@example.com'], 'accessRoleIds': []} for i in range(userCount)]
+  roles = [{'id': roleId, 'emails': [], 'teamIds': []} for roleId in roleIds]
+  return TenantGraph(users=users, teams=teams, roles=roles, policies=policies, apps=apps)
+
+def recomputedClassify(graph, users):
+  emails = list(users.keys())
+  teamIds = uniqueList([teamId for user in users.values() for teamId in user.teamIds or ()])
+  accessRoleIds = uniqueList([roleId for user in users.values() for roleId in user.accessRoleIds or ()])
+  deletablePolicyIds = []
+  for policyId in graph.policyApps:
+    if policyId in graph.policies and graph.policyRoles.get(policyId, set()) <= set(accessRoleIds):
+      deletablePolicyIds.append(policyId)
+  links = {}
+  for teamId in teamIds:
+    links[teamId] = [email for email, user in users.items() if teamId in (user.teamIds or ())]
+  for roleId in accessRoleIds:
+    links[roleId] = [email for email, user in users.items() if roleId in (user.accessRoleIds or ())]
+  deletableTeamIds = [teamId for teamId in teamIds if teamId in graph.teams and len(graph.teamUsers[teamId] - set(emails)) == 0 and len(graph.teamRoles[teamId] - set(accessRoleIds)) == 0]
+  deletableRoleIds = [roleId for roleId in accessRoleIds if roleId in graph.roles and len(graph.roleUsers[roleId] - set(emails)) == 0 and len(graph.roleTeams[roleId] - set(teamIds)) == 0]
+  return deletablePolicyIds, links, deletableTeamIds, deletableRoleIds
+
+def scopeClassify(graph, users):
+  scope = PurgeScope(users)
+  return classifyPurge(graph, scope), scope.teamEmails, scope.roleEmails
+
+def run(name, fn, graph, users):
+  start = time.perf_counter()
+  fn(graph, users)
+  elapsed = time.perf_counter() - start
+  print(f'{name:>8}: {len(graph.policies)} policies, {len(users)} users removed, {elapsed:.3f}s')
+
+def main(argsdict):
+  graph = syntheticTenant(argsdict.get('policies'), argsdict.get('tenantUsers'))
+  users = {email: User.fromJson(user) for email, user in list(graph.users.items())[:argsdict.get('users')]}
+  run('before', recomputedClassify, graph, users)
+  run('after', scopeClassify, graph, users)
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark the purge classification with sets rebuilt per iteration against a PurgeScope')
+  parser.add_argument('--policies', dest='policies', type=int, default=50000,
+                      required=False, help='Number of policies of the synthetic tenant')
+  parser.add_argument('--tenant-users', dest='tenantUsers', type=int, default=5000,
+                      required=False, help='Number of users of the synthetic tenant')
+  parser.add_argument('--users', dest='users', type=int, default=1000,
+                      required=False, help='Number of users removed')
+  args = parser.parse_args()
+  main(vars(args))
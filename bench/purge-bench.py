@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# NOTE: Compare the pydash path string bookkeeping purge-user.py used to do,
+#       mapping apps to policies and rewriting the rules of policies, with
+#       planPurge over a TenantGraph, on a synthetic tenant held in memory.
+#       No request is sent.
+
+import os
+import sys
+import time
+import argparse
+
+import pydash
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lib.graph import TenantGraph
+from lib.plan import planPurge
+from lib.records import User
+
+
+def syntheticTenant(appCount):
+  """
+  Two apps per policy, every policy has two rules over three roles, every
+  role has one user and one team.
+  """
+  roleCount = max(appCount // 10, 3)
+  roleIds = [f'role-{i}' for i in range(roleCount)]
+  users = [{'id': f'user{i}@example.com', 'email': f'user{i}@example.com', 'teamIds': [f'team-{i}'], 'accessRoleIds': [roleIds[i]]} for i in range(roleCount)]
+  teams = [{'id': f'team-{i}', 'name': f'team {i}', 'emails': [f'user{i}@example.com'], 'accessRoleIds': []} for i in range(roleCount)]
+  roles = [{'id': roleIds[i], 'name': f'role {i}', 'emails': [f'user{i}@example.com'], 'teamIds': [f'team-{i}']} for i in range(roleCount)]
+  policies = [
+    {
+      'id': f'policy-{i}',
+      'name': f'policy {i}',
+      'rules': [
+        {'accessRoleIds': [roleIds[i % roleCount], roleIds[(i + 1) % roleCount]], 'actions': ['copy']},
+        {'accessRoleIds': [roleIds[(i + 2) % roleCount]], 'actions': ['paste']},
+      ],
+    }
+    for i in range(appCount // 2)
+  ]
+  apps = [{'id': f'app-{i}', 'name': f'app {i}', 'policyId': f'policy-{i // 2}'} for i in range(appCount)]
+  return {'users': users, 'teams': teams, 'roles': roles, 'policies': policies, 'apps': apps}
+
+def pydashPurge(tenant, users):
+  accessRoleIds = pydash.flatten([user.get('accessRoleIds') for user in users])
+  policyAppMapper = {}
+  for app in tenant['apps']:
+    appId = app.get('id')
+    policyId = app.get('policyId')
+    if bool(policyId):
+      appIds = pydash.get(policyAppMapper, f'{policyId}.appId', [])
+      appIds.append(appId)
+      pydash.set_(policyAppMapper, f'{policyId}.appId', appIds)
+
+  policies = {policy.get('id'): policy for policy in tenant['policies']}
+  for policyId in list(policyAppMapper.keys()):
+    policyRoleIds = pydash.flatten_deep([pydash.objects.get(rule, 'accessRoleIds') for rule in pydash.objects.get(policies[policyId], 'rules')])
+    pydash.set_(policyAppMapper, f'{policyId}.deletable', set(policyRoleIds) <= set(accessRoleIds))
+  deletablePolicyMapper = pydash.pick_by(policyAppMapper, lambda item: pydash.get(item, 'deletable') == True)
+  deletableAppIds = pydash.flatten_deep([pydash.get(deletablePolicyMapper, f'{i}.appId') for i in deletablePolicyMapper])
+
+  updatablePolicyDataSet = {}
+  orphanPolicyIds = {}
+  for policy in tenant['policies']:
+    policyId = policy.get('id')
+    policyRoleIds = []
+    for ruleIdx, rule in enumerate(pydash.objects.get(policy, 'rules') or []):
+      ruleRoleIds = rule.get('accessRoleIds') or []
+      policyRoleIds.append(ruleRoleIds)
+      remainingRuleRoleIds = list(set(ruleRoleIds) - set(accessRoleIds))
+      if len(remainingRuleRoleIds) > 0 and len(ruleRoleIds) != len(remainingRuleRoleIds):
+        newPolicy = pydash.get(updatablePolicyDataSet, policyId, pydash.clone_deep(policy))
+        pydash.set_(newPolicy, f'rules.{ruleIdx}.accessRoleIds', remainingRuleRoleIds)
+        pydash.set_(updatablePolicyDataSet, policyId, newPolicy)
+      elif len(remainingRuleRoleIds) == 0:
+        newPolicy = pydash.get(updatablePolicyDataSet, policyId, pydash.clone_deep(policy))
+        pydash.set_(newPolicy, f'rules.{ruleIdx}.accessRoleIds', [])
+        pydash.set_(updatablePolicyDataSet, policyId, newPolicy)
+    if set(pydash.flatten_deep(policyRoleIds)) <= set(accessRoleIds):
+      pydash.set_(orphanPolicyIds, policyId, policy)
+  for policyId in updatablePolicyDataSet:
+    policy = pydash.get(updatablePolicyDataSet, policyId)
+    if pydash.get(orphanPolicyIds, policyId, None) != None:
+      continue
+    pydash.set_(policy, 'rules', [rule for rule in policy.get('rules', []) if len(rule.get('accessRoleIds', [])) > 0])
+  return deletableAppIds, updatablePolicyDataSet
+
+def graphPurge(tenant, users):
+  graph = TenantGraph(**tenant)
+  return planPurge({user['email']: User.fromJson(user) for user in users}, graph)
+
+def run(name, fn, tenant, users):
+  start = time.perf_counter()
+  fn(tenant, users)
+  elapsed = time.perf_counter() - start
+  print(f'{name:>8}: {len(tenant["apps"])} apps, {len(users)} users removed, {elapsed:.3f}s')
+
+def main(argsdict):
+  tenant = syntheticTenant(argsdict.get('apps'))
+  users = tenant['users'][:argsdict.get('users')]
+  run('before', pydashPurge, tenant, users)
+  run('after', graphPurge, tenant, users)
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark pydash path strings against the TenantGraph purge engine')
+  parser.add_argument('--apps', dest='apps', type=int, default=100000,
+                      required=False, help='Number of apps of the synthetic tenant')
+  parser.add_argument('--users', dest='users', type=int, default=1000,
+                      required=False, help='Number of users removed')
+  args = parser.parse_args()
+  main(vars(args))
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# NOTE: Compare bare `requests` calls with the shared session of lib/common
+#       against a local stand-in API server. Every new TCP connection on the
+#       stand-in counts as one handshake (a TLS one against the real API_HOST).
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import lib.common
+from lib.common import USER_API
+from lib.common import getResource
+from lib.common import closeSession
+
+connectionCount = 0
+connectionLock = threading.Lock()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+  disable_nagle_algorithm = True
+
+  def setup(self):
+    global connectionCount
+    with connectionLock:
+      connectionCount += 1
+    super().setup()
+
+  def do_GET(self):
+    body = json.dumps({'id': self.path.rsplit('/', 1)[-1], 'teamIds': [], 'accessRoleIds': []}).encode()
+    self.send_response(200)
+    self.send_header('content-type', 'application/json')
+    self.send_header('content-length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+
+def bareGetResource(id, idToken, url):
+  resp = requests.get(
+    f'{lib.common.API_HOST}{url}/{id}',
+    headers={'content-type': 'application/json', 'idToken': idToken})
+  return resp.json()
+
+def run(name, fn, count):
+  global connectionCount
+  connectionCount = 0
+  start = time.perf_counter()
+  for i in range(count):
+    fn(id=f'user{i}@example.com', idToken='token', url=USER_API)
+  elapsed = time.perf_counter() - start
+  print(f'{name:>8}: {count} requests, {connectionCount} handshakes, {elapsed:.3f}s')
+
+def main(argsdict):
+  server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+  thread = threading.Thread(target=server.serve_forever, daemon=True)
+  thread.start()
+  lib.common.API_HOST = f'http://127.0.0.1:{server.server_port}'
+  try:
+    run('before', bareGetResource, argsdict.get('count'))
+    run('after', getResource, argsdict.get('count'))
+  finally:
+    closeSession()
+    server.shutdown()
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark bare requests against the shared session')
+  parser.add_argument('--count', dest='count', type=int, default=500,
+                      required=False, help='Number of requests per run')
+  args = parser.parse_args()
+  main(vars(args))
@@ -1,6 +1,11 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+import os
+import sys
+import csv
+import json
+import asyncio
 import logging
 import argparse
 
@@ -13,101 +18,200 @@ from lib.common import TEAM_API
 from lib.common import ROLE_API
 from lib.common import POLICY_API
 from lib.common import APP_API
+from lib.common import API_CONCURRENCY
 
 from lib.common import getToken
 from lib.common import booleanString
-from lib.create import createResource
+from lib.common import argString
+from lib.common import configureConcurrency
+from lib.create import createResourceAsync
+from lib.purge import purgeResourceAsync
+from lib.graph import loadTenantGraph
 
 
+def readRows(path, fmt=None):
+  """
+  Read users to create from a CSV file with a header line or from JSON lines,
+  `-` reads stdin. Each row needs `email` and `ssh` (host:port), `name`,
+  `adminRole`, `actions` (separated by `;`) and `protocol` are optional.
+  """
+  if fmt == None:
+    fmt = 'jsonl' if os.path.splitext(path)[1] in {'.jsonl', '.json'} else 'csv'
+  f = sys.stdin if path == '-' else open(path, 'r', newline='')
+  try:
+    if fmt == 'jsonl':
+      rows = [json.loads(line) for line in f if bool(line.strip())]
+    else:
+      rows = [dict(row) for row in csv.DictReader(f)]
+  finally:
+    if f != sys.stdin:
+      f.close()
+  return rows
+
+async def createUserChain(idToken, row):
+  """
+  Create a user and its own team, role, policy and app, one after the other as
+  each object refers to the previous one. Returns the ids of the created objects.
+  When a step fails the objects already created are removed again, so a user
+  that exists always has its whole chain.
+  """
+  email = row['email']
+  name = row.get('name') or email.split('@')[0]
+  host, _, port = str(row.get('ssh')).rpartition(':')
+  if not bool(host) or not port.isdigit():
+    raise ValueError(f'Invalid ssh host:port: {row.get("ssh")}')
+  port = int(port)
+  actions = row.get('actions') or ['copy', 'paste']
+  if isinstance(actions, str):
+    actions = [action.strip() for action in actions.split(';') if bool(action.strip())]
+  logging.warning(f'Add user: {email}')
+
+  # NOTE: (url, id) of the objects created so far, removed in reverse order on failure
+  created = []
+
+  async def create(url, data):
+    output = await createResourceAsync(idToken=idToken, url=url, data=data)
+    # NOTE: users are addressed by email, whatever id the API gives them
+    created.append((url, email if url == USER_API else output.get('id')))
+    return output
+
+  try:
+    user = await create(
+      url=USER_API,
+      data={
+        'suspended': False,
+        'name': name,
+        'teamIds': [],
+        'adminRole': row.get('adminRole') or 'user',
+        'mfa': False,
+        'accessRoleIds': [],
+        'email': email
+      },
+    )
+    team = await create(
+      url=TEAM_API,
+      data={
+        'name': name,
+        'emails': [
+          email,
+        ],
+        'accessRoleIds': [
+        ]
+      },
+    )
+    teamId = team.get('id')
+    role = await create(
+      url=ROLE_API,
+      data={
+        'name': name,
+        'emails': [
+          email,
+        ],
+        'teamIds': [
+          teamId,
+        ]
+      },
+    )
+    roleId = role.get('id')
+    policy = await create(
+      url=POLICY_API,
+      data={
+        'name': name,
+        'rules': [
+          {
+            'accessRoleIds': [
+              roleId
+            ],
+            'actions': actions,
+          },
+        ]
+      },
+    )
+    policyId = policy.get('id')
+    app = await create(
+      url=APP_API,
+      data={
+        'name': name,
+        'type': 'saas',
+        'policyId': policyId,
+        'isolation': True,
+        'iconUrl': None,
+        'protocol': row.get('protocol') or 'ssh',
+        'host': [host],
+        'port': port,
+      },
+    )
+    return {
+      'userId': user.get('id'),
+      'teamId': teamId,
+      'roleId': roleId,
+      'policyId': policyId,
+      'appId': app.get('id'),
+    }
+  except Exception:
+    for url, id in reversed(created):
+      try:
+        status = await purgeResourceAsync(False, id=id, idToken=idToken, url=url)
+      except Exception as e:
+        status = e
+      if not isinstance(status, int) or status >= 400:
+        logging.error(f'Roll back {email}: {url}, {id} left behind, {status}')
+    raise
+
+async def createUserChains(idToken, rows, parallel, graph):
+  """
+  Create the chains of all rows, at most `parallel` at a time, and print one
+  status line per row as soon as it is done. Users already in the TenantGraph
+  are skipped, so a partly imported file can be run again.
+  """
+  semaphore = asyncio.Semaphore(parallel)
+
+  async def createRow(index, row):
+    async with semaphore:
+      status = {'row': index, 'email': row.get('email')}
+      try:
+        if graph.hasUser(row.get('email')):
+          status['status'] = 'exists'
+        else:
+          status.update(await createUserChain(idToken, row))
+          status['status'] = 'ok'
+      except Exception as e:
+        status.update({'status': 'failed', 'error': str(e)})
+      print(json.dumps(status), flush=True)
+      return status
+
+  return await asyncio.gather(*[createRow(index, row) for index, row in enumerate(rows, start=1)])
+
 def main(argsdict):
   debug = argsdict.get('debug')
+  inputPath = argsdict.get('input')
   if debug:
     logging.getLogger().setLevel(logging.DEBUG)
-  name = USER_EMAIL.split('@')[0]
-  email = USER_EMAIL
-  host = USER_SSH_IP.split(':')[0]
-  port = int(USER_SSH_IP.split(':')[1])
   idToken = getToken(apiSecret=API_SECRET, apiKey=API_KEY)
-  logging.warning(f'Add user: {email}')
+  if not bool(inputPath):
+    asyncio.run(createUserChain(idToken, {'email': USER_EMAIL, 'ssh': USER_SSH_IP}))
+    return
 
-  user = createResource(
-    idToken=idToken,
-    url=USER_API,
-    data={
-      'suspended': False,
-      'name': name,
-      'teamIds': [],
-      'adminRole': 'user',
-      'mfa': False,
-      'accessRoleIds': [],
-      'email': email
-    },
-  )
-  team = createResource(
-    idToken=idToken,
-    url=TEAM_API,
-    data={
-      'name': name,
-      'emails': [
-        email,
-      ],
-      'accessRoleIds': [
-      ]
-    },
-  )
-  teamId = team.get('id')
-  role = createResource(
-    idToken=idToken,
-    url=ROLE_API,
-    data={
-      'name': name,
-      'emails': [
-        email,
-      ],
-      'teamIds': [
-        teamId,
-      ]
-    },
-  )
-  roleId = role.get('id')
-  policy = createResource(
-    idToken=idToken,
-    url=POLICY_API,
-    data={
-      'name': name,
-      'rules': [
-        {
-          'accessRoleIds': [
-            roleId
-          ],
-          'actions': [
-            'copy',
-            'paste',
-          ]
-        },
-      ]
-    },
-  )
-  policyId = policy.get('id')
-  app = createResource(
-    idToken=idToken,
-    url=APP_API,
-    data={
-      'name': name,
-      'type': 'saas',
-      'policyId': policyId,
-      'isolation': True,
-      'iconUrl': None,
-      'protocol': 'ssh',
-      'host': [host],
-      'port': port,
-    },
-  )
-  appId = app.get('id')
+  rows = readRows(inputPath, argsdict.get('format'))
+  # NOTE: the worker pool bounds the requests in flight, size it for --parallel chains
+  configureConcurrency(argsdict.get('parallel'))
+  graph = loadTenantGraph(idToken, types=['users'])
+  statuses = asyncio.run(createUserChains(idToken, rows, argsdict.get('parallel'), graph))
+  created = [status for status in statuses if status['status'] == 'ok']
+  failed = [status for status in statuses if status['status'] == 'failed']
+  logging.warning(f'Created: {len(created)}, Existing: {len(statuses) - len(created) - len(failed)}, Failed: {len(failed)}')
+  if len(failed) > 0:
+    sys.exit(1)
 
 if __name__ == '__main__':
   parser = argparse.ArgumentParser(description='Add new user and associated objects')
   parser.add_argument('--debug', dest='debug', type=booleanString, default=False,
                       required=False, help='Output verbose log')
+  parser.add_argument('--input', dest='input', type=argString, default=None,
+                      required=False, help='CSV or JSON lines file of users to add, - reads stdin. Defaults to USER_EMAIL and USER_SSH_IP')
+  parser.add_argument('--format', dest='format', choices=['csv', 'jsonl'], default=None,
+                      required=False, help='Format of the input file, guessed from its extension by default')
+  parser.add_argument('--parallel', dest='parallel', type=int, default=API_CONCURRENCY,
+                      required=False, help='Number of users created at the same time, also the number of concurrent requests')
   args = parser.parse_args()
   main(vars(args))
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import logging
+import argparse
+import collections
+
+from lib.common import API_KEY
+from lib.common import API_SECRET
+from lib.common import API_CONCURRENCY
+
+from lib.common import getToken
+from lib.common import booleanString
+from lib.graph import loadTenantGraph
+from lib.plan import planGc
+from lib.plan import goneMissingPolicies
+from lib.plan import applyPlan
+from lib.retry import getRetryStats
+from lib.snapshot import API_SNAPSHOT
+from lib.snapshot import configureSnapshot
+
+
+def main(argsdict):
+  dryrun = argsdict.get('dryrun')
+  debug = argsdict.get('debug')
+  if debug:
+    logging.getLogger().setLevel(logging.DEBUG)
+  # NOTE: only a dry run may rely on the snapshot, a real sweep reads the live tenant
+  configureSnapshot(enabled=argsdict.get('cache'), refresh=argsdict.get('refresh') or not dryrun)
+  idToken = getToken(apiSecret=API_SECRET, apiKey=API_KEY)
+
+  # NOTE: a sweep only deletes policies, their roles are all it reads
+  graph = loadTenantGraph(idToken, fields={'policies': ['id', 'rules.accessRoleIds']})
+  # NOTE: apps are only removed with their policy once a read by id confirms it is gone
+  plan = planGc(graph, gonePolicyIds=goneMissingPolicies(graph, idToken))
+  counts = collections.Counter([operation['url'].split('/v1/', 2)[1] for operation in plan['operations']])
+  logging.warning(f'Remove orphans: {dict(counts) or "none"}, Dryrun: {dryrun}')
+  applyPlan(dryrun, plan, idToken, workers=argsdict.get('workers'))
+  logging.debug(f'Retry stats: {getRetryStats()}')
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Remove orphan policies, apps, teams and roles of the whole tenant')
+  parser.add_argument('--dryrun', dest='dryrun', type=booleanString, default=True,
+                      required=True, help='In dryrun mode, no objects will be deleted')
+  parser.add_argument('--debug', dest='debug', type=booleanString, default=False,
+                      required=False, help='Output verbose log')
+  parser.add_argument('--workers', dest='workers', type=int, default=API_CONCURRENCY,
+                      required=False, help='Number of deletes run at the same time')
+  parser.add_argument('--cache', dest='cache', type=booleanString, default=API_SNAPSHOT,
+                      required=False, help='In dryrun mode, read the tenant from the local snapshot while it is fresh')
+  parser.add_argument('--refresh', dest='refresh', type=booleanString, default=False,
+                      required=False, help='Read the tenant from the API and update the local snapshot')
+
+  args = parser.parse_args()
+  main(vars(args))
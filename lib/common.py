@@ -2,11 +2,35 @@
 
 import os
 import json
+import asyncio
+import time
+import hashlib
 import logging
+import functools
+import threading
 import urllib
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 import pydash
+from requests.adapters import HTTPAdapter
+
+from .tokencache import readCachedToken
+from .tokencache import writeCachedToken
+from .tokencache import dropCachedToken
+from .tokencache import tokenExpiry
+from .tokencache import API_TOKEN_TTL
+from .tokencache import API_TOKEN_REFRESH_MARGIN
+from .retry import sendWithRetry
+from .ratelimit import acquireRateLimit
+from .snapshot import readSnapshot
+from .snapshot import writeSnapshot
+from .snapshot import dropSnapshot
+from .snapshot import snapshotEnabled
+from .jsonstream import API_STREAM_CHUNK
+from .jsonstream import readChunks
+from .jsonstream import readJson
+from .projection import project
 
 API_HOST = os.getenv('API_HOST', 'https://api.appaegis.net')
 USER_EMAIL = os.getenv('USER_EMAIL')
@@ -14,6 +38,22 @@ USER_SSH_IP = os.getenv('USER_SSH_IP')
 API_KEY = os.getenv('API_KEY')
 API_SECRET = os.getenv('API_SECRET')
 
+# NOTE: connection pool of the shared session, see configureSession
+API_POOL_CONNECTIONS = int(os.getenv('API_POOL_CONNECTIONS', '4'))
+API_POOL_MAXSIZE = int(os.getenv('API_POOL_MAXSIZE', '16'))
+API_POOL_BLOCK = os.getenv('API_POOL_BLOCK', 'false').lower() in {'true', 't', 'yes', 'y'}
+API_KEEP_ALIVE = os.getenv('API_KEEP_ALIVE', 'true').lower() in {'true', 't', 'yes', 'y'}
+API_CONNECT_TIMEOUT = float(os.getenv('API_CONNECT_TIMEOUT', '10'))
+API_READ_TIMEOUT = float(os.getenv('API_READ_TIMEOUT', '60'))
+# NOTE: number of requests the async helpers keep in flight
+API_CONCURRENCY = int(os.getenv('API_CONCURRENCY', '8'))
+# NOTE: objects per page for iterResources, 0 reads a collection in one request
+API_PAGE_SIZE = int(os.getenv('API_PAGE_SIZE', '0'))
+# NOTE: parse list responses of iterResources object by object
+API_JSON_STREAM = os.getenv('API_JSON_STREAM', 'true').lower() in {'true', 't', 'yes', 'y'}
+# NOTE: ids sent in one LOOK_UP_IDS_API request
+API_LOOKUP_CHUNK = int(os.getenv('API_LOOKUP_CHUNK', '100'))
+
 TOKEN_EXCHANGE = '/api/v1/authentication'
 USER_API = '/api/v1/users'
 TEAM_API = '/api/v1/teams'
@@ -23,6 +63,26 @@ APP_API = '/api/v1/applications'
 LOOK_UP_IDS_API = '/api/v1/util/lookupIds'
 
 NETWORKS_API = '/api/v1/networks'
+# NOTE: users, teams and roles each hold the memberships between them, changing one changes the others
+MEMBERSHIP_APIS = (USER_API, TEAM_API, ROLE_API)
+
+_sessionConfig = {
+  'poolConnections': API_POOL_CONNECTIONS,
+  'poolMaxsize': API_POOL_MAXSIZE,
+  'poolBlock': API_POOL_BLOCK,
+  'keepAlive': API_KEEP_ALIVE,
+  'timeout': (API_CONNECT_TIMEOUT, API_READ_TIMEOUT),
+}
+_session = None
+_sessionLock = threading.Lock()
+_executor = None
+# NOTE: credentials and expiry of every token handed out by getToken
+_tokenOwners = {}
+# NOTE: stale token -> token that replaced it
+_tokenRenewals = {}
+_tokenLock = threading.Lock()
+# NOTE: set once LOOK_UP_IDS_API turned out to be missing on API_HOST
+_lookupUnavailable = False
 
 def booleanString(s):
   if s.lower() not in {'false', 'true', 't', 'f', 'yes', 'no', 'y', 'n'}:
@@ -32,36 +92,418 @@ def booleanString(s):
 def argString(s):
   return str(s)
 
-def getToken(apiKey, apiSecret):
-  payload = {
-    'apiSecret': apiSecret,
+def configureSession(poolConnections=None, poolMaxsize=None, poolBlock=None, keepAlive=None, timeout=None):
+  """
+  Change the settings of the shared session. `poolConnections` is the number of
+  hosts kept in the pool, `poolMaxsize` the number of connections kept per host.
+  The current session is closed and recreated with the new settings on next use.
+  """
+  global _session
+  options = {
+    'poolConnections': poolConnections,
+    'poolMaxsize': poolMaxsize,
+    'poolBlock': poolBlock,
+    'keepAlive': keepAlive,
+    'timeout': timeout,
+  }
+  with _sessionLock:
+    _sessionConfig.update({k: v for k, v in options.items() if v != None})
+    if _session != None:
+      _session.close()
+      _session = None
+
+def getSession():
+  """
+  Return the process-wide requests session, all API helpers share its connection pool.
+  """
+  global _session
+  with _sessionLock:
+    if _session == None:
+      adapter = HTTPAdapter(
+        pool_connections=_sessionConfig['poolConnections'],
+        pool_maxsize=_sessionConfig['poolMaxsize'],
+        pool_block=_sessionConfig['poolBlock'],
+      )
+      session = requests.Session()
+      session.mount('https://', adapter)
+      session.mount('http://', adapter)
+      session.headers.update({'content-type': 'application/json'})
+      if not _sessionConfig['keepAlive']:
+        session.headers.update({'Connection': 'close'})
+      _session = session
+    return _session
+
+def closeSession():
+  global _session
+  with _sessionLock:
+    if _session != None:
+      _session.close()
+      _session = None
+
+def getExecutor():
+  """
+  Return the worker pool the async helpers run blocking requests on. Its size
+  bounds how many requests are in flight at once.
+  """
+  global _executor
+  with _sessionLock:
+    if _executor == None:
+      _executor = ThreadPoolExecutor(max_workers=API_CONCURRENCY, thread_name_prefix='api')
+    return _executor
+
+def configureConcurrency(concurrency):
+  global _executor, API_CONCURRENCY
+  with _sessionLock:
+    API_CONCURRENCY = concurrency
+    previous, _executor = _executor, None
+  # NOTE: running tasks may need the lock, the old pool is drained once it is released
+  if previous != None:
+    previous.shutdown(wait=True)
+
+async def runAsync(fn, *args, **kwargs):
+  """
+  Run a blocking helper on the bounded worker pool from a coroutine.
+  """
+  loop = asyncio.get_running_loop()
+  return await loop.run_in_executor(getExecutor(), functools.partial(fn, *args, **kwargs))
+
+def currentToken(idToken):
+  """
+  Follow renewals of `idToken`, so callers holding a stale token send the fresh one.
+  """
+  while idToken in _tokenRenewals:
+    idToken = _tokenRenewals[idToken]
+  return idToken
+
+def refreshToken(staleToken):
+  """
+  Replace `staleToken` with a newly exchanged one. Only the first caller does the
+  exchange, concurrent callers holding the same stale token wait for its result.
+  """
+  with _tokenLock:
+    token = currentToken(staleToken)
+    if token != staleToken:
+      return token
+    owner = _tokenOwners.get(staleToken)
+    if owner == None:
+      return staleToken
+    logging.debug('Refresh token')
+    dropCachedToken(API_HOST, owner['apiKey'])
+    token = getToken(apiKey=owner['apiKey'], apiSecret=owner['apiSecret'], refresh=True)
+    if token != None and token != staleToken:
+      _tokenRenewals[staleToken] = token
+      return token
+    return staleToken
+
+def tokenExpiring(idToken):
+  owner = _tokenOwners.get(idToken)
+  return owner != None and owner['expiresAt'] - API_TOKEN_REFRESH_MARGIN <= time.time()
+
+def request(method, url, idToken=None, retry=None, **kwargs):
+  """
+  Send one API request through the shared session, `url` is relative to API_HOST.
+  Tokens from getToken are refreshed when they are about to expire, and a request
+  rejected with 401 is replayed once with a refreshed token. Transient failures
+  are retried as described in lib.retry, `retry` overrides the per-method default.
+  Every attempt waits for the rate limits of lib.ratelimit.
+  """
+  kwargs.setdefault('timeout', _sessionConfig['timeout'])
+
+  def send(token):
+    headers = {}
+    if token != None:
+      headers['idToken'] = token
+
+    def attempt():
+      acquireRateLimit(url)
+      return getSession().request(method, f'{API_HOST}{url}', headers=headers, **kwargs)
+
+    return sendWithRetry(method, attempt, retry=retry)
+
+  token = currentToken(idToken)
+  if tokenExpiring(token):
+    token = refreshToken(token)
+  resp = send(token)
+  if resp.status_code == 401 and token in _tokenOwners:
+    logging.debug(f'Token rejected: {url}')
+    renewedToken = refreshToken(token)
+    if renewedToken != token:
+      resp = send(renewedToken)
+  if method.upper() not in {'GET', 'HEAD', 'OPTIONS'} and url != TOKEN_EXCHANGE:
+    # NOTE: the collection changed, don't serve it from the snapshot anymore
+    urls = [url]
+    if any(url == api or url.startswith(f'{api}/') for api in MEMBERSHIP_APIS):
+      urls.extend(MEMBERSHIP_APIS)
+    dropSnapshot(API_HOST, tenantKey(), urls)
+  return resp
+
+def getToken(apiKey, apiSecret, refresh=False):
+  """
+  Exchange the API key for a token. Tokens are cached on disk per API_HOST and
+  API key until shortly before they expire, `refresh` skips the cache.
+  """
+  entry = None if refresh else readCachedToken(API_HOST, apiKey)
+  if entry == None:
+    payload = {
+      'apiSecret': apiSecret,
+      'apiKey': apiKey,
+    }
+    resp = request('POST', TOKEN_EXCHANGE, data=json.dumps(payload), retry=True)
+    output = resp.json()
+    token = output.get('Authorization', None)
+    if token == None:
+      return None
+    entry = {
+      'token': token,
+      'expiresAt': tokenExpiry(token, default=time.time() + API_TOKEN_TTL),
+    }
+    writeCachedToken(API_HOST, apiKey, entry)
+  token = entry['token']
+  _tokenOwners[token] = {
     'apiKey': apiKey,
+    'apiSecret': apiSecret,
+    'expiresAt': entry['expiresAt'],
   }
-  resp = requests.post(
-    f'{API_HOST}{TOKEN_EXCHANGE}',
-    data=json.dumps(payload),
-    headers={'content-type': 'application/json'})
-  output = resp.json()
-  return output.get('Authorization', None)
+  return token
 
 
-def getResource(id, idToken, url):
+def getResource(id, idToken, url, fields=None):
+  """
+  Read one object, `fields` keeps only these fields as described in lib.projection.
+  """
   logging.debug(f'Read by id: {url}, {id}')
   quotedId = urllib.parse.quote(id)
   url = f'{url}/{quotedId}'
-  resp = requests.get(
-    f'{API_HOST}{url}',
-    headers={'content-type': 'application/json', 'idToken': idToken})
+  resp = request('GET', url, idToken=idToken)
   output = resp.json()
   error = pydash.get(output, 'error', None)
   if resp.status_code >= 400 or error != None:
     raise Exception(output)
-  return output
+  return project(output, fields)
+
+def findResource(id, idToken, url, fields=None):
+  """
+  Read one object like getResource, None when the API answers 404. Any other
+  error raises.
+  """
+  logging.debug(f'Read by id: {url}, {id}')
+  quotedId = urllib.parse.quote(id)
+  resp = request('GET', f'{url}/{quotedId}', idToken=idToken)
+  if resp.status_code == 404:
+    return None
+  output = resp.json()
+  error = pydash.get(output, 'error', None) if isinstance(output, dict) else None
+  if resp.status_code >= 400 or error != None:
+    raise Exception(output)
+  return project(output, fields)
+
+def resourceExists(id, idToken, url):
+  """
+  Read one object by id: False when the API answers 404, True when it is
+  there. Any other answer raises, the object may or may not exist.
+  """
+  logging.debug(f'Check exists: {url}, {id}')
+  quotedId = urllib.parse.quote(id)
+  resp = request('GET', f'{url}/{quotedId}', idToken=idToken)
+  if resp.status_code == 404:
+    return False
+  if resp.status_code >= 400:
+    raise Exception(f'Check {url}/{id}: status {resp.status_code}')
+  return True
 
-def getResources(idToken, url):
+def tenantKey():
+  return hashlib.sha256(str(API_KEY).encode('utf-8')).hexdigest()[:16]
+
+def getResources(idToken, url, fields=None):
+  """
+  Read a whole collection. When the snapshot of lib.snapshot is enabled, a copy
+  younger than its TTL is returned without calling the API. `fields` keeps only
+  these fields of every object as described in lib.projection.
+  """
+  output = readSnapshot(API_HOST, tenantKey(), url)
+  if output != None:
+    return [project(item, fields) for item in output]
   logging.debug(f'Read all: {url}')
-  resp = requests.get(
-    f'{API_HOST}{url}',
-    headers={'content-type': 'application/json', 'idToken': idToken})
+  resp = request('GET', url, idToken=idToken)
   output = resp.json()
+  if resp.status_code < 400 and isinstance(output, list):
+    writeSnapshot(API_HOST, tenantKey(), url, output)
+    return [project(item, fields) for item in output]
   return output
+
+def closingItems(resp, items):
+  try:
+    yield from items
+  finally:
+    resp.close()
+
+def readPage(idToken, url, params, stream):
+  """
+  Read one page of a collection. Returns `(items, cursor, envelope)`, the
+  envelope is the object wrapping the items without them, None for a list
+  body. With `stream` a list body is parsed as its elements are consumed.
+  """
+  logging.debug(f'Read page: {url}, {params}')
+  resp = request('GET', url, idToken=idToken, params=params, stream=stream)
+  if resp.status_code >= 400 or not stream:
+    items, output = None, resp.json()
+  else:
+    items, output = readJson(readChunks(resp.iter_content(chunk_size=API_STREAM_CHUNK)))
+  if items != None:
+    return closingItems(resp, items), None, None
+  error = pydash.get(output, 'error', None) if isinstance(output, dict) else None
+  if resp.status_code >= 400 or error != None:
+    raise Exception(output)
+  if isinstance(output, dict):
+    itemsKey = 'items' if 'items' in output else 'data'
+    if not isinstance(output.get(itemsKey), list):
+      raise Exception(f'Unexpected page of {url}: no items or data in {list(output.keys())}')
+    envelope = {name: value for name, value in output.items() if name != itemsKey}
+    return output[itemsKey], output.get('nextCursor'), envelope
+  if not isinstance(output, list):
+    raise Exception(f'Unexpected page of {url}: {type(output).__name__}')
+  return output, None, None
+
+def iterResources(idToken, url, pageSize=None, fields=None, stream=None):
+  """
+  Yield the objects of a collection one at a time. With a page size (default
+  API_PAGE_SIZE) pages are requested with `limit` and `offset`, or with the
+  `cursor` the server hands out in an `{items|data, nextCursor}` envelope,
+  so only one page is held at a time. A server that ignores the paging
+  parameters is detected and read once. With `stream` (default API_JSON_STREAM)
+  list bodies are parsed object by object instead of whole, and `fields` keeps
+  only these fields of every object.
+  """
+  cached = readSnapshot(API_HOST, tenantKey(), url)
+  if cached != None:
+    for item in cached:
+      yield project(item, fields)
+    return
+  pageSize = API_PAGE_SIZE if pageSize == None else pageSize
+  stream = API_JSON_STREAM if stream == None else stream
+  params = {'limit': pageSize} if pageSize > 0 else {}
+  # NOTE: the snapshot needs the whole collection, only kept when it is enabled
+  collected = [] if snapshotEnabled() else None
+  offset = 0
+  received = 0
+  firstId = None
+  while True:
+    items, cursor, envelope = readPage(idToken, url, params, stream)
+    count = 0
+    repeated = False
+    for item in items:
+      if count == 0 and offset > 0 and item.get('id') == firstId:
+        # NOTE: same first page again, the server doesn't page this collection
+        repeated = True
+        break
+      if firstId == None:
+        firstId = item.get('id')
+      count += 1
+      received += 1
+      if collected != None:
+        collected.append(item)
+      yield project(item, fields)
+    if hasattr(items, 'close'):
+      # NOTE: release the connection of a page left unread
+      items.close()
+    if envelope != None and not bool(cursor):
+      # NOTE: an envelope announcing more objects than read is a truncated answer
+      total = envelope.get('total', envelope.get('count'))
+      if isinstance(total, int) and total > received:
+        raise Exception(f'Read {received} of {total} objects of {url}, the collection is incomplete')
+    if repeated or pageSize <= 0:
+      break
+    if bool(cursor):
+      params = {'limit': pageSize, 'cursor': cursor}
+      continue
+    if envelope != None or count != pageSize:
+      break
+    offset += count
+    params = {'limit': pageSize, 'offset': offset}
+  if collected != None:
+    writeSnapshot(API_HOST, tenantKey(), url, collected)
+
+async def getResourceAsync(id, idToken, url, fields=None):
+  return await runAsync(getResource, id=id, idToken=idToken, url=url, fields=fields)
+
+async def findResourceAsync(id, idToken, url, fields=None):
+  return await runAsync(findResource, id=id, idToken=idToken, url=url, fields=fields)
+
+async def getResourcesAsync(idToken, url, fields=None):
+  return await runAsync(getResources, idToken=idToken, url=url, fields=fields)
+
+async def getResourcesByIdAsync(ids, idToken, url, fields=None):
+  """
+  Read many resources of one type concurrently, results keep the order of `ids`.
+  """
+  return await asyncio.gather(*[getResourceAsync(id=id, idToken=idToken, url=url, fields=fields) for id in ids])
+
+def lookupIdsChunk(ids, idToken, fields=None):
+  """
+  Resolve one chunk of ids with LOOK_UP_IDS_API. The answer is either a list of
+  objects or an object keyed by id. Returns None when the endpoint is missing,
+  rejects the request or doesn't answer with objects, ex: an object mapping ids
+  to names. Objects without one of `fields` are summaries, they are left out.
+  """
+  resp = request('POST', LOOK_UP_IDS_API, idToken=idToken, data=json.dumps({'ids': ids}), retry=True)
+  if 400 <= resp.status_code < 500:
+    logging.debug(f'Lookup rejected: {LOOK_UP_IDS_API}, status {resp.status_code}')
+    return None
+  output = resp.json()
+  error = pydash.get(output, 'error', None) if isinstance(output, dict) else None
+  if resp.status_code >= 400 or error != None:
+    raise Exception(output)
+  items = output.values() if isinstance(output, dict) else output
+  if not isinstance(output, (dict, list)) or any(item != None and not isinstance(item, dict) for item in items):
+    logging.debug(f'Lookup answer without objects: {LOOK_UP_IDS_API}')
+    return None
+  # NOTE: top level names of the fields, ex: 'rules' for 'rules.accessRoleIds'
+  names = {field.split('.')[0] for field in fields or ()}
+  if isinstance(output, dict):
+    return {id: project(item, fields) for id, item in output.items() if item != None and names <= item.keys()}
+  wanted = set(ids)
+  found = {}
+  for item in output:
+    if not names <= item.keys():
+      continue
+    for key in ('id', 'email'):
+      if item.get(key) in wanted:
+        found[item.get(key)] = project(item, fields)
+  return found
+
+async def lookupIdsAsync(ids, idToken, url, fields=None):
+  """
+  Resolve many ids in chunks of API_LOOKUP_CHUNK with LOOK_UP_IDS_API, returns
+  id -> object without the ids that were not found. Ids missing from the
+  answer, or all of them when the endpoint is not available, are read one by
+  one from `url`. `fields` keeps only these fields of every object as
+  described in lib.projection.
+  """
+  global _lookupUnavailable
+  ids = list(dict.fromkeys(ids))
+  found = {}
+  if not _lookupUnavailable:
+    chunks = [ids[i:i + API_LOOKUP_CHUNK] for i in range(0, len(ids), API_LOOKUP_CHUNK)]
+    outputs = await asyncio.gather(*[runAsync(lookupIdsChunk, chunk, idToken, fields) for chunk in chunks])
+    for output in outputs:
+      found.update(output or {})
+    if any(output == None for output in outputs):
+      logging.debug(f'Lookup not available, read by id: {url}')
+      _lookupUnavailable = True
+    # NOTE: the lookup may leave out ids it can't resolve, they are read by id
+    ids = [id for id in ids if id not in found]
+    if len(ids) > 0:
+      logging.debug(f'Lookup missed {len(ids)} ids, read by id: {url}')
+
+  async def fetch(id):
+    output = await findResourceAsync(id=id, idToken=idToken, url=url, fields=fields)
+    if output != None:
+      found[id] = output
+    else:
+      logging.debug(f'Not found: {url}, {id}')
+
+  await asyncio.gather(*[fetch(id) for id in ids])
+  return found
+
+def lookupIds(ids, idToken, url, fields=None):
+  return asyncio.run(lookupIdsAsync(ids, idToken, url, fields=fields))
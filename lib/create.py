@@ -3,21 +3,20 @@
 import json
 import logging
 
-import requests
 import pydash
 
-from .common import API_HOST
+from .common import request
+from .common import runAsync
+from .records import Record
 
 
 def createResource(idToken, url, data = None):
   kwargs = {}
+  if isinstance(data, Record):
+    data = data.toJson()
   if data != None:
     pydash.set_(kwargs, 'data', json.dumps(data))
-  resp = requests.post(
-    f'{API_HOST}{url}',
-    headers={'content-type': 'application/json', 'idToken': idToken},
-    **kwargs,
-  )
+  resp = request('POST', url, idToken=idToken, **kwargs)
   output = resp.json()
   # NOTE: not allow resource creating only with out new user entry
   error = pydash.get(output, 'error', None)
@@ -25,3 +24,6 @@ def createResource(idToken, url, data = None):
     logging.error(output)
     raise Exception(output)
   return output
+
+async def createResourceAsync(idToken, url, data = None):
+  return await runAsync(createResource, idToken=idToken, url=url, data=data)
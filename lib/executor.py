@@ -0,0 +1,65 @@
+# coding: utf-8
+
+import heapq
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import wait
+
+
+def runGraph(nodes, deps, run, workers):
+  """
+  Run `run(key, node)` for every node of a DAG on `workers` threads. `deps` maps
+  a key to the keys that must succeed first. Ready nodes start in the order of
+  `nodes`. When a node fails, nodes depending on it, directly or not, are skipped.
+  Returns `(results, errors, skipped)`, results and errors keyed by node key.
+  """
+  dependents = {key: [] for key in nodes}
+  waiting = {}
+  for key in nodes:
+    keyDeps = set(deps.get(key, []))
+    waiting[key] = len(keyDeps)
+    for dep in keyDeps:
+      dependents[dep].append(key)
+
+  results = {}
+  errors = {}
+  skipped = []
+  order = {key: index for index, key in enumerate(nodes)}
+  # NOTE: heap of (index in `nodes`, key) of the nodes ready to start
+  ready = [(order[key], key) for key in nodes if waiting[key] == 0]
+
+  def skip(key):
+    pending = [key]
+    while len(pending) > 0:
+      current = pending.pop()
+      for dependent in dependents[current]:
+        if waiting[dependent] >= 0:
+          waiting[dependent] = -1
+          skipped.append(dependent)
+          pending.append(dependent)
+
+  with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='plan') as executor:
+    running = {}
+    while len(ready) > 0 or len(running) > 0:
+      # NOTE: at most `workers` nodes are submitted, the rest wait here, so an
+      #       interrupt only waits for the operations already running
+      while len(ready) > 0 and len(running) < workers:
+        _, key = heapq.heappop(ready)
+        running[executor.submit(run, key, nodes[key])] = key
+      done, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+      for future in done:
+        key = running.pop(future)
+        error = future.exception()
+        if error != None:
+          logging.error(f'Failed: {key}, {error}')
+          errors[key] = error
+          skip(key)
+          continue
+        results[key] = future.result()
+        for dependent in dependents[key]:
+          if waiting[dependent] > 0:
+            waiting[dependent] -= 1
+            if waiting[dependent] == 0:
+              heapq.heappush(ready, (order[dependent], dependent))
+  return results, errors, skipped
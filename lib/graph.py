@@ -0,0 +1,196 @@
+# coding: utf-8
+
+import asyncio
+import logging
+import threading
+from collections import defaultdict
+
+from .common import USER_API
+from .common import TEAM_API
+from .common import ROLE_API
+from .common import POLICY_API
+from .common import APP_API
+from .common import iterResources
+from .common import runAsync
+from .records import User
+from .records import Team
+from .records import Role
+from .records import Policy
+from .records import App
+
+RESOURCE_APIS = {
+  'users': USER_API,
+  'teams': TEAM_API,
+  'roles': ROLE_API,
+  'policies': POLICY_API,
+  'apps': APP_API,
+}
+# NOTE: fields the graph reads from each type, see lib.projection. Policies are kept whole as they are sent back in updates
+GRAPH_FIELDS = {
+  'users': ['id', 'email', 'teamIds', 'accessRoleIds'],
+  'teams': ['id', 'emails', 'accessRoleIds'],
+  'roles': ['id', 'emails', 'teamIds'],
+  'policies': None,
+  'apps': ['id', 'policyId'],
+}
+
+
+class TenantGraph:
+  """
+  Users, teams, roles, policies and apps of a tenant with indexes in both
+  directions of every relationship, so dependency questions are dict lookups.
+  Objects are kept as the records of lib.records, users keyed by email, the
+  other objects by id. Links are read from both ends, ex: a team lists its
+  emails and a user lists its teamIds.
+  """
+
+  def __init__(self, users=None, teams=None, roles=None, policies=None, apps=None):
+    self.users = {}
+    self.teams = {}
+    self.roles = {}
+    self.policies = {}
+    self.apps = {}
+
+    self.userTeams = defaultdict(set)
+    self.teamUsers = defaultdict(set)
+    self.userRoles = defaultdict(set)
+    self.roleUsers = defaultdict(set)
+    self.teamRoles = defaultdict(set)
+    self.roleTeams = defaultdict(set)
+    self.policyRoles = defaultdict(set)
+    self.rolePolicies = defaultdict(set)
+    # NOTE: roleId -> (policyId, ruleIdx) of the rules granting it
+    self.roleRules = defaultdict(list)
+    # NOTE: policyId -> index of the rules without roles, policies without rules map to none
+    self.emptyRules = {}
+    self.policyOrder = {}
+    self.policyApps = defaultdict(list)
+    self.appPolicy = {}
+
+    for user in users or []:
+      self.addUser(user)
+    for team in teams or []:
+      self.addTeam(team)
+    for role in roles or []:
+      self.addRole(role)
+    for policy in policies or []:
+      self.addPolicy(policy)
+    for app in apps or []:
+      self.addApp(app)
+
+  def addUser(self, user):
+    user = User.fromJson(user)
+    email = user.email or user.id
+    self.users[email] = user
+    for teamId in user.teamIds or ():
+      self.userTeams[email].add(teamId)
+      self.teamUsers[teamId].add(email)
+    for roleId in user.accessRoleIds or ():
+      self.userRoles[email].add(roleId)
+      self.roleUsers[roleId].add(email)
+
+  def addTeam(self, team):
+    team = Team.fromJson(team)
+    teamId = team.id
+    self.teams[teamId] = team
+    for email in team.emails or ():
+      self.userTeams[email].add(teamId)
+      self.teamUsers[teamId].add(email)
+    for roleId in team.accessRoleIds or ():
+      self.teamRoles[teamId].add(roleId)
+      self.roleTeams[roleId].add(teamId)
+
+  def addRole(self, role):
+    role = Role.fromJson(role)
+    roleId = role.id
+    self.roles[roleId] = role
+    for email in role.emails or ():
+      self.userRoles[email].add(roleId)
+      self.roleUsers[roleId].add(email)
+    for teamId in role.teamIds or ():
+      self.teamRoles[teamId].add(roleId)
+      self.roleTeams[roleId].add(teamId)
+
+  def addPolicy(self, policy):
+    policy = Policy.fromJson(policy)
+    policyId = policy.id
+    self.policies[policyId] = policy
+    self.policyOrder.setdefault(policyId, len(self.policyOrder))
+    rules = policy.rules or ()
+    if len(rules) == 0:
+      self.emptyRules[policyId] = []
+    for ruleIdx, rule in enumerate(rules):
+      if len(rule.accessRoleIds or ()) == 0:
+        self.emptyRules.setdefault(policyId, []).append(ruleIdx)
+      for roleId in rule.accessRoleIds or ():
+        self.policyRoles[policyId].add(roleId)
+        self.rolePolicies[roleId].add(policyId)
+        self.roleRules[roleId].append((policyId, ruleIdx))
+
+  def addApp(self, app):
+    app = App.fromJson(app)
+    appId = app.id
+    policyId = app.policyId
+    self.apps[appId] = app
+    # policy exists
+    if bool(policyId):
+      self.policyApps[policyId].append(appId)
+      self.appPolicy[appId] = policyId
+
+  def hasUser(self, email):
+    return email in self.users
+
+  def appsOfPolicy(self, policyId):
+    return self.policyApps.get(policyId, [])
+
+  def rulesOfRoles(self, roleIds):
+    """
+    policyId -> index of its rules granting one of `roleIds` or without roles at
+    all, for the policies a removal of `roleIds` can change, in tenant order.
+    """
+    rules = defaultdict(set)
+    for roleId in roleIds:
+      for policyId, ruleIdx in self.roleRules.get(roleId, ()):
+        rules[policyId].add(ruleIdx)
+    for policyId, ruleIdxs in self.emptyRules.items():
+      rules[policyId].update(ruleIdxs)
+    return {policyId: sorted(rules[policyId]) for policyId in sorted(rules, key=self.policyOrder.get)}
+
+  def missingPolicyApps(self):
+    """
+    Apps pointing to a policy that is not in the tenant.
+    """
+    return [appId for appId, policyId in self.appPolicy.items() if policyId not in self.policies]
+
+
+async def loadTenantGraphAsync(idToken, types=None, users=None, fields=None):
+  """
+  Read the resource `types` (all five by default) concurrently and index them
+  as the objects stream in, without holding the raw collections. Only the
+  GRAPH_FIELDS of every object are kept, `fields` overrides them per type.
+  `users` can be given instead of listing every user of the tenant.
+  """
+  types = [type for type in (types or RESOURCE_APIS.keys()) if not (type == 'users' and users != None)]
+  logging.debug(f'Load tenant graph: {types}')
+  graph = TenantGraph(users=users)
+  adders = {
+    'users': graph.addUser,
+    'teams': graph.addTeam,
+    'roles': graph.addRole,
+    'policies': graph.addPolicy,
+    'apps': graph.addApp,
+  }
+  # NOTE: indexes are shared between types, one reader adds at a time
+  lock = threading.Lock()
+  fields = {**GRAPH_FIELDS, **(fields or {})}
+
+  def load(type):
+    for item in iterResources(idToken=idToken, url=RESOURCE_APIS[type], fields=fields[type]):
+      with lock:
+        adders[type](item)
+
+  await asyncio.gather(*[runAsync(load, type) for type in types])
+  return graph
+
+def loadTenantGraph(idToken, types=None, users=None, fields=None):
+  return asyncio.run(loadTenantGraphAsync(idToken, types=types, users=users, fields=fields))
@@ -0,0 +1,110 @@
+# coding: utf-8
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+
+import msgpack
+
+from .tokencache import CACHE_DIR
+
+API_JOURNAL_DIR = os.getenv('API_JOURNAL_DIR', os.path.join(CACHE_DIR, 'journal'))
+# NOTE: seconds an unfinished plan may be resumed, older ones were computed from a tenant that has moved on
+API_RESUME_MAX_AGE = int(os.getenv('API_RESUME_MAX_AGE', '3600'))
+
+
+class Journal:
+  """
+  Append-only log of the operations of one plan run that completed, so an
+  interrupted apply can resume where it stopped. Each line is a JSON record,
+  the last one marks the plan as done.
+  """
+
+  def __init__(self, runId, reset = False):
+    self.runId = runId
+    self.path = os.path.join(API_JOURNAL_DIR, f'{runId}.log')
+    self.completed = set()
+    self.done = False
+    self.lock = threading.Lock()
+    if reset and os.path.exists(self.path):
+      os.remove(self.path)
+    if os.path.exists(self.path):
+      with open(self.path, 'r') as f:
+        for line in f:
+          try:
+            record = json.loads(line)
+          except ValueError:
+            # NOTE: torn last line of a crashed run
+            continue
+          if record.get('done'):
+            self.done = True
+          elif 'op' in record:
+            self.completed.add(record['op'])
+    os.makedirs(API_JOURNAL_DIR, mode=0o700, exist_ok=True)
+    self.file = open(self.path, 'a')
+
+  def write(self, record):
+    with self.lock:
+      self.file.write(json.dumps(record) + '\n')
+      self.file.flush()
+      os.fsync(self.file.fileno())
+
+  def record(self, key):
+    self.write({'op': key, 'at': time.time()})
+    with self.lock:
+      self.completed.add(key)
+
+  def finish(self):
+    self.write({'done': True, 'at': time.time()})
+    self.done = True
+
+  def close(self):
+    self.file.close()
+
+
+def planStorePath(runId):
+  return os.path.join(API_JOURNAL_DIR, f'{runId}.plan.msgpack')
+
+def jobPath(host, emails):
+  digest = hashlib.sha256('\n'.join([host] + sorted(emails)).encode('utf-8')).hexdigest()[:16]
+  return os.path.join(API_JOURNAL_DIR, f'{digest}.job')
+
+def storePlan(plan, host, emails):
+  """
+  Keep a copy of the plan next to its journal, and remember it as the current
+  plan for this set of emails.
+  """
+  os.makedirs(API_JOURNAL_DIR, mode=0o700, exist_ok=True)
+  with open(planStorePath(plan['runId']), 'wb') as f:
+    f.write(msgpack.packb(plan, use_bin_type=True))
+  with open(jobPath(host, emails), 'w') as f:
+    f.write(plan['runId'])
+
+def unfinishedPlan(host, emails, maxAge = None):
+  """
+  Return the stored plan of an earlier run for the same emails that did not
+  finish and is younger than `maxAge` seconds (default API_RESUME_MAX_AGE),
+  None otherwise.
+  """
+  maxAge = API_RESUME_MAX_AGE if maxAge == None else maxAge
+  try:
+    with open(jobPath(host, emails), 'r') as f:
+      runId = f.read().strip()
+    with open(planStorePath(runId), 'rb') as f:
+      plan = msgpack.unpackb(f.read(), raw=False)
+  except OSError:
+    return None
+  journal = Journal(runId)
+  journal.close()
+  if journal.done:
+    return None
+  createdAt = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(plan['createdAt']))
+  age = time.time() - plan['createdAt']
+  if age > maxAge:
+    logging.warning(f'Not resuming plan {plan["id"]}, run {runId}: created at {createdAt}, {age:.0f}s ago, older than {maxAge}s')
+    return None
+  logging.warning(f'Resume plan {plan["id"]}, run {runId}, created at {createdAt}: {len(journal.completed)} of {len(plan["operations"])} operations done')
+  return plan
@@ -0,0 +1,88 @@
+# coding: utf-8
+
+import os
+import json
+import codecs
+
+# NOTE: bytes read from the socket at a time when a response is parsed incrementally
+API_STREAM_CHUNK = int(os.getenv('API_STREAM_CHUNK', '65536'))
+
+WHITESPACE = ' \t\n\r'
+DELIMITERS = WHITESPACE + ',]'
+
+_decoder = json.JSONDecoder()
+
+
+def readChunks(chunks):
+  """
+  Decode utf-8 byte chunks, ex: from `resp.iter_content`, into text chunks.
+  """
+  decoder = codecs.getincrementaldecoder('utf-8')()
+  for chunk in chunks:
+    text = decoder.decode(chunk)
+    if len(text) > 0:
+      yield text
+  text = decoder.decode(b'', final=True)
+  if len(text) > 0:
+    yield text
+
+def iterArray(buffer, chunks):
+  """
+  Yield the elements of the JSON array opened at the start of `buffer`, reading
+  more of `chunks` whenever an element is incomplete. Parsed text is dropped
+  from the buffer when it is refilled, so only the current chunk and the element
+  being parsed are held.
+  """
+  pos = 1
+  expectValue = True
+  while True:
+    while pos < len(buffer) and buffer[pos] in WHITESPACE:
+      pos += 1
+    if pos >= len(buffer):
+      chunk = next(chunks, None)
+      if chunk == None:
+        raise ValueError('Unterminated JSON array')
+      buffer = buffer[pos:] + chunk
+      pos = 0
+      continue
+    if buffer[pos] == ']':
+      return
+    if buffer[pos] == ',' and not expectValue:
+      pos += 1
+      expectValue = True
+      continue
+    if not expectValue:
+      raise ValueError(f'Expected "," or "]" in JSON array, got {buffer[pos]!r}')
+    try:
+      value, end = _decoder.raw_decode(buffer, pos)
+    except ValueError:
+      value, end = None, None
+    # NOTE: a value not followed by a delimiter may go on in the next chunk, ex: "-1.5" of "-1.5e3"
+    if end == None or end >= len(buffer) or buffer[end] not in DELIMITERS:
+      chunk = next(chunks, None)
+      if chunk == None:
+        raise ValueError(f'Invalid JSON array element at {pos}')
+      buffer = buffer[pos:] + chunk
+      pos = 0
+      continue
+    yield value
+    # NOTE: the buffer is only cut when it is refilled, cutting it per element copies the chunk every time
+    pos = end
+    expectValue = False
+
+def readJson(chunks):
+  """
+  Parse a JSON body from text chunks. Returns `(items, None)` when the body is an
+  array, `items` yielding its elements as they are parsed, `(None, output)` for
+  any other body, parsed whole.
+  """
+  chunks = iter(chunks)
+  buffer = ''
+  for chunk in chunks:
+    buffer += chunk
+    if len(buffer.lstrip(WHITESPACE)) > 0:
+      break
+  buffer = buffer.lstrip(WHITESPACE)
+  if buffer.startswith('['):
+    return iterArray(buffer, chunks), None
+  return None, json.loads(buffer + ''.join(chunks))
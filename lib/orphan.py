@@ -0,0 +1,87 @@
+# coding: utf-8
+
+from .records import PolicyPatch
+
+
+def findOrphans(graph, emails = (), teamIds = (), roleIds = (), skipPolicyIds = ()):
+  """
+  Find what is left dangling once `emails`, with their `teamIds` and `roleIds`,
+  are removed from the TenantGraph, in one pass over its teams, roles and apps.
+  Policies are only visited when the role index of the graph points to them.
+  Without emails this is a tenant-wide sweep. Returns:
+    policyRules: policyId -> policy, as sent to the API, with the roles removed from its rules
+    policies: policies left without any role
+    teamLinks: teamId -> emails, teams whose only members are removed
+    roles: roles whose only members are removed, and whose teams are too
+    emptyTeams: teams without any member
+    emptyRoles: roles without any member or team
+    apps: apps pointing to a policy that does not exist
+  Teams and roles in `teamIds` and `roleIds` are left to the caller.
+  """
+  # NOTE: frozensets, ex: of a PurgeScope, are used as they are
+  emails = frozenset(emails)
+  teamIds = frozenset(teamIds)
+  roleIds = frozenset(roleIds)
+  skipPolicyIds = frozenset(skipPolicyIds)
+  orphans = {
+    'policyRules': {},
+    'policies': [],
+    'teamLinks': {},
+    'roles': [],
+    'emptyTeams': [],
+    'emptyRoles': [],
+    'apps': graph.missingPolicyApps(),
+  }
+
+  # NOTE: handle orphan policy once app was deleted before
+  policyPatches = {}
+  orphanPolicyIds = {}
+  # NOTE: only policies granting a removed role, or with rules without roles, can change
+  for policyId, ruleIdxs in graph.rulesOfRoles(roleIds).items():
+    if policyId in skipPolicyIds:
+      continue
+    policy = graph.policies[policyId]
+    for ruleIdx in ruleIdxs:
+      ruleRoleIds = policy.rules[ruleIdx].accessRoleIds or ()
+
+      # NOTE: Handle the detail Configure policy, rules left without roles are dropped by the patch
+      remainingRuleRoleIds = [roleId for roleId in ruleRoleIds if roleId not in roleIds]
+      if len(remainingRuleRoleIds) == 0 or len(remainingRuleRoleIds) != len(ruleRoleIds):
+        patch = policyPatches.get(policyId)
+        if patch == None:
+          patch = policyPatches[policyId] = PolicyPatch(policy)
+        patch.setRuleRoles(ruleIdx, remainingRuleRoleIds)
+
+    # NOTE: In case the policyRoleIds is totally equal with userRoleIds, we will delete it.
+    #       Without roles at all the relationship was removed previously.
+    if graph.policyRoles.get(policyId, frozenset()) <= roleIds:
+      orphanPolicyIds[policyId] = policy
+
+  # NOTE: Handle Configure policy, deleted policies don't need a payload
+  for policyId, patch in policyPatches.items():
+    if policyId in orphanPolicyIds:
+      continue
+    orphans['policyRules'][policyId] = patch.toJson()
+  orphans['policies'] = list(orphanPolicyIds.keys())
+
+  # NOTE: teams of the removed users are handled by the caller
+  for teamId, team in graph.teams.items():
+    if teamId in teamIds:
+      continue
+    teamEmails = graph.teamUsers.get(teamId, set())
+    if len(teamEmails) == 0:
+      orphans['emptyTeams'].append(teamId)
+    elif teamEmails <= emails:
+      orphans['teamLinks'][teamId] = sorted(teamEmails)
+
+  # NOTE: skip roles including others relationship, roles of the removed users are handled by the caller
+  for roleId, role in graph.roles.items():
+    if roleId in roleIds:
+      continue
+    roleEmails = graph.roleUsers.get(roleId, set())
+    roleTeamIds = graph.roleTeams.get(roleId, set())
+    if len(roleEmails) == 0 and len(roleTeamIds) == 0:
+      orphans['emptyRoles'].append(roleId)
+    elif len(roleEmails) > 0 and roleEmails <= emails and roleTeamIds <= teamIds:
+      orphans['roles'].append(roleId)
+  return orphans
@@ -0,0 +1,360 @@
+# coding: utf-8
+
+import os
+import json
+import time
+import hashlib
+import secrets
+import logging
+
+import msgpack
+
+from .common import API_HOST
+from .common import USER_API
+from .common import TEAM_API
+from .common import ROLE_API
+from .common import POLICY_API
+from .common import APP_API
+from .common import resourceExists
+from .purge import updateResource
+from .purge import purgeResource
+from .executor import runGraph
+from .orphan import findOrphans
+
+# NOTE: stages of a purge plan, in the order they are applied
+STAGE_APPS = 'apps'
+STAGE_POLICIES = 'policies'
+STAGE_LINKS = 'links'
+STAGE_TEAMS_ROLES = 'teams-roles'
+STAGE_POLICY_RULES = 'policy-rules'
+STAGE_ORPHANS = 'orphans'
+STAGE_USERS = 'users'
+STAGES = [
+  STAGE_APPS,
+  STAGE_POLICIES,
+  STAGE_LINKS,
+  STAGE_TEAMS_ROLES,
+  STAGE_POLICY_RULES,
+  STAGE_ORPHANS,
+  STAGE_USERS,
+]
+
+ACTION_UPDATE = 'update'
+ACTION_PURGE = 'purge'
+
+PLAN_VERSION = 1
+
+# NOTE: a sweep finding more policies missing than this doesn't trust the listing
+API_GC_MAX_MISSING = int(os.getenv('API_GC_MAX_MISSING', '20'))
+# NOTE: seconds a saved plan may be applied after it was computed, its policy updates overwrite later rule edits
+API_PLAN_MAX_AGE = int(os.getenv('API_PLAN_MAX_AGE', '86400'))
+
+
+def newOperation(stage, action, url, id, data = None):
+  return {
+    'stage': stage,
+    'action': action,
+    'url': url,
+    'id': id,
+    'data': data,
+  }
+
+def planDigest(plan):
+  """
+  Hash of the content of a plan, the operations and what they apply to.
+  """
+  content = {name: plan.get(name) for name in ('version', 'host', 'emails', 'operations')}
+  canonical = json.dumps(content, sort_keys=True, separators=(',', ':'))
+  return hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:16]
+
+def newPlan(emails, operations):
+  """
+  Wrap operations into a plan for API_HOST. The plan id is the digest of the
+  content and checks a plan file is intact. The run id is new for every plan,
+  it keys the journal, so a later purge computing the same operations is not
+  taken for one already applied.
+  """
+  plan = {
+    'version': PLAN_VERSION,
+    'host': API_HOST,
+    'emails': list(emails),
+    'operations': operations,
+  }
+  plan['id'] = planDigest(plan)
+  plan['runId'] = secrets.token_hex(8)
+  plan['createdAt'] = time.time()
+  return plan
+
+def isMsgpackPath(path):
+  return os.path.splitext(path)[1] in {'.msgpack', '.mpk'}
+
+def writePlan(plan, path):
+  """
+  Save a plan as msgpack for `*.msgpack`/`*.mpk` files, as compact JSON otherwise.
+  """
+  if isMsgpackPath(path):
+    with open(path, 'wb') as f:
+      f.write(msgpack.packb(plan, use_bin_type=True))
+  else:
+    with open(path, 'w') as f:
+      json.dump(plan, f, separators=(',', ':'))
+  logging.warning(f'Plan {plan["id"]}: {len(plan["operations"])} operations written to {path}')
+
+def readPlan(path):
+  if isMsgpackPath(path):
+    with open(path, 'rb') as f:
+      plan = msgpack.unpackb(f.read(), raw=False)
+  else:
+    with open(path, 'r') as f:
+      plan = json.load(f)
+  if plan.get('version') != PLAN_VERSION:
+    raise Exception(f'Unsupported plan version: {plan.get("version")}')
+  if plan.get('host') != API_HOST:
+    raise Exception(f'Plan {plan.get("id")} was made for {plan.get("host")}, not {API_HOST}')
+  if plan.get('id') != planDigest(plan):
+    raise Exception(f'Plan {plan.get("id")} in {path} was modified or is damaged')
+  # NOTE: plans written before run ids were added are journaled by their id
+  plan.setdefault('runId', plan['id'])
+  return plan
+
+def checkPlanAge(plan, maxAge = None):
+  """
+  Refuse a plan computed more than `maxAge` seconds ago (default
+  API_PLAN_MAX_AGE), its policy updates hold the whole policy as it was read and
+  would undo the changes made since. `maxAge` 0 accepts any plan.
+  """
+  maxAge = API_PLAN_MAX_AGE if maxAge == None else maxAge
+  if maxAge <= 0:
+    return
+  if plan.get('createdAt') == None:
+    raise Exception(f'Plan {plan["id"]} has no creation time, compute it again or set --max-age 0')
+  createdAt = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(plan['createdAt']))
+  age = time.time() - plan['createdAt']
+  if age > maxAge:
+    raise Exception(f'Plan {plan["id"]} was created at {createdAt}, {age:.0f}s ago, older than {maxAge}s: compute it again or raise --max-age')
+
+def uniqueList(items):
+  return list(dict.fromkeys(items))
+
+class PurgeScope:
+  """
+  Memberships of the users to remove, computed once per purge: the users, teams
+  and roles of all of them together, as frozensets for the membership checks
+  and as lists keeping the order of `users`, and the users holding each team
+  and role. A scope of one user holds the sets of that user.
+  """
+  __slots__ = ('emails', 'teamIds', 'roleIds', 'emailSet', 'teamSet', 'roleSet', 'teamEmails', 'roleEmails')
+
+  def __init__(self, users):
+    self.emails = list(users.keys())
+    # NOTE: team/role -> users holding it, in the order of `users`
+    self.teamEmails = {}
+    self.roleEmails = {}
+    for email, user in users.items():
+      for teamId in uniqueList(user.teamIds or ()):
+        self.teamEmails.setdefault(teamId, []).append(email)
+      for roleId in uniqueList(user.accessRoleIds or ()):
+        self.roleEmails.setdefault(roleId, []).append(email)
+    self.teamIds = list(self.teamEmails.keys())
+    self.roleIds = list(self.roleEmails.keys())
+    self.emailSet = frozenset(self.emails)
+    self.teamSet = frozenset(self.teamIds)
+    self.roleSet = frozenset(self.roleIds)
+
+def classifyPurge(graph, scope):
+  """
+  What can be deleted with the users of a PurgeScope, from the TenantGraph: each
+  policy, team and role is classified with set checks against the scope.
+  Returns policies whose roles all go away with their apps, and teams and roles
+  held only by the users and by each other.
+  """
+  # NOTE: Check each policy with apps if it's deletable or not. It only handles ruleRoleLink except Role
+  #       Policies missing from the tenant are left as they are.
+  deletable = {
+    'policies': [],
+    'apps': [],
+    'teams': [],
+    'roles': [],
+  }
+  for policyId in graph.policyApps:
+    if policyId not in graph.policies:
+      continue
+    # NOTE: In case the policyRoleIds is totally equal with userRoleIds, we will delete it.
+    if graph.policyRoles.get(policyId, frozenset()) <= scope.roleSet:
+      deletable['policies'].append(policyId)
+      deletable['apps'].extend(graph.appsOfPolicy(policyId))
+
+  # NOTE: remove teams, check the team contains only these users and roles
+  for teamId in scope.teamIds:
+    if teamId not in graph.teams:
+      continue
+    if graph.teamUsers.get(teamId, frozenset()) <= scope.emailSet and graph.teamRoles.get(teamId, frozenset()) <= scope.roleSet:
+      deletable['teams'].append(teamId)
+
+  # NOTE: remove roles, check the role contains only these users and teams
+  for roleId in scope.roleIds:
+    if roleId not in graph.roles:
+      continue
+    if graph.roleUsers.get(roleId, frozenset()) <= scope.emailSet and graph.roleTeams.get(roleId, frozenset()) <= scope.teamSet:
+      deletable['roles'].append(roleId)
+  return deletable
+
+def planPurge(users, graph):
+  """
+  Compute the operations removing `users` (email -> User record) and the objects
+  only they use, from the TenantGraph of the tenant. Operations shared by
+  several users are merged, ex: a team is unlinked from all of them in one call
+  and a policy is rewritten once.
+  """
+  operations = []
+  # TODO: check the team contains only this user
+  #       also need to skip "groups"
+  scope = PurgeScope(users)
+  deletable = classifyPurge(graph, scope)
+
+  # NOTE: delete app if its policy will be deleted.
+  for appId in deletable['apps']:
+    operations.append(newOperation(STAGE_APPS, ACTION_PURGE, APP_API, appId))
+
+  # NOTE: delete policy something like policyEntry, policyRole relationship and ruleEntry
+  for policyId in deletable['policies']:
+    operations.append(newOperation(STAGE_POLICIES, ACTION_PURGE, POLICY_API, policyId))
+
+  # NOTE: remove relationship something like userTeamLink, userRoleLink, teamRoleLink.
+  #       Every link is removed for all users holding it in one call.
+  for teamId, teamEmails in scope.teamEmails.items():
+    operations.append(newOperation(STAGE_LINKS, ACTION_PURGE, f'{TEAM_API}/{teamId}/users/', teamId, data=teamEmails))
+  for roleId, roleEmails in scope.roleEmails.items():
+    roleTeamIds = uniqueList([teamId for email in roleEmails for teamId in users[email].teamIds or ()])
+    operations.append(newOperation(STAGE_LINKS, ACTION_PURGE, f'{ROLE_API}/{roleId}/users/', roleId, data=roleEmails))
+    operations.append(newOperation(STAGE_LINKS, ACTION_PURGE, f'{ROLE_API}/{roleId}/teams/', roleId, data=roleTeamIds))
+
+  for teamId in deletable['teams']:
+    operations.append(newOperation(STAGE_TEAMS_ROLES, ACTION_PURGE, TEAM_API, teamId))
+  for roleId in deletable['roles']:
+    operations.append(newOperation(STAGE_TEAMS_ROLES, ACTION_PURGE, ROLE_API, roleId))
+
+  # NOTE: handle orphan policy, team and role once app was deleted before, in one pass for all users
+  orphans = findOrphans(graph, scope.emailSet, scope.teamSet, scope.roleSet, skipPolicyIds=deletable['policies'])
+  for policyId, policy in orphans['policyRules'].items():
+    operations.append(newOperation(STAGE_POLICY_RULES, ACTION_UPDATE, POLICY_API, policyId, data=policy))
+  for policyId in orphans['policies']:
+    operations.append(newOperation(STAGE_POLICY_RULES, ACTION_PURGE, POLICY_API, policyId))
+  # NOTE: Other case will be hanlded by user deleting
+  for teamId, teamEmails in orphans['teamLinks'].items():
+    operations.append(newOperation(STAGE_ORPHANS, ACTION_PURGE, f'{TEAM_API}/{teamId}/users/', teamId, data=teamEmails))
+  for roleId in orphans['roles']:
+    operations.append(newOperation(STAGE_ORPHANS, ACTION_PURGE, ROLE_API, roleId))
+
+  # NOTE: remove userEntry, and his relationship team, rule link, etc
+  for userId in scope.emails:
+    operations.append(newOperation(STAGE_USERS, ACTION_PURGE, USER_API, userId))
+  return newPlan(scope.emails, operations)
+
+def goneMissingPolicies(graph, idToken, maxMissing = None):
+  """
+  Policies apps of the TenantGraph point to but the policy listing lacks, each
+  confirmed gone by a read of its id answering 404. More missing policies than
+  `maxMissing` (default API_GC_MAX_MISSING), or a missing one that can be read,
+  mean the listing is incomplete, and raise.
+  """
+  maxMissing = API_GC_MAX_MISSING if maxMissing == None else maxMissing
+  policyIds = uniqueList([graph.appPolicy[appId] for appId in graph.missingPolicyApps()])
+  if len(policyIds) > maxMissing:
+    raise Exception(f'{len(policyIds)} policies of apps are missing from {POLICY_API}, more than {maxMissing}, the listing may be incomplete')
+  for policyId in policyIds:
+    if resourceExists(policyId, idToken=idToken, url=POLICY_API):
+      raise Exception(f'Policy {policyId} is missing from {POLICY_API} but exists, the listing is incomplete')
+  return policyIds
+
+def planGc(graph, gonePolicyIds = ()):
+  """
+  Compute the operations removing what no user needs anymore from a TenantGraph
+  of the whole tenant: policies without roles with their apps, apps pointing to
+  policies confirmed gone (see goneMissingPolicies), teams without members and
+  roles without members or teams.
+  """
+  operations = []
+  orphans = findOrphans(graph)
+  gonePolicyIds = set(gonePolicyIds)
+  goneApps = [appId for appId in orphans['apps'] if graph.appPolicy[appId] in gonePolicyIds]
+  appIds = uniqueList(goneApps + [appId for policyId in orphans['policies'] for appId in graph.appsOfPolicy(policyId)])
+  for appId in appIds:
+    operations.append(newOperation(STAGE_APPS, ACTION_PURGE, APP_API, appId))
+  for policyId in orphans['policies']:
+    operations.append(newOperation(STAGE_POLICIES, ACTION_PURGE, POLICY_API, policyId))
+  for teamId in orphans['emptyTeams']:
+    operations.append(newOperation(STAGE_TEAMS_ROLES, ACTION_PURGE, TEAM_API, teamId))
+  for roleId in orphans['emptyRoles']:
+    operations.append(newOperation(STAGE_TEAMS_ROLES, ACTION_PURGE, ROLE_API, roleId))
+  return newPlan([], operations)
+
+def applyOperation(dryrun, operation, idToken):
+  """
+  Send one operation. Server errors, left after retries, raise so the operation
+  is not journaled as done; other error statuses are only logged, ex: deleting
+  an object that is already gone.
+  """
+  url = operation['url']
+  id = operation['id']
+  data = operation.get('data')
+  if operation['action'] == ACTION_UPDATE:
+    # NOTE: updateResource consumes the id of the payload
+    status = updateResource(dryrun, id=id, idToken=idToken, url=url, data=dict(data))
+  else:
+    status = purgeResource(dryrun, id=id, idToken=idToken, url=url, data=data)
+  if dryrun != True and (status >= 500 or status == 429):
+    raise Exception(f'{operation["action"]} {url} {id}: status {status}')
+  if dryrun != True and status >= 400:
+    logging.warning(f'{operation["action"]} {url} {id}: status {status}')
+  return status
+
+def planGraph(plan):
+  """
+  Turn the plan into a DAG for runGraph. Operations of one stage are independent,
+  each stage waits for a barrier node that depends on every operation of the
+  previous stage. Operations are keyed by their index in the plan.
+  """
+  nodes = {}
+  deps = {}
+  barrier = None
+  for stage in STAGES:
+    keys = [index for index, operation in enumerate(plan['operations']) if operation['stage'] == stage]
+    if len(keys) == 0:
+      continue
+    for key in keys:
+      nodes[key] = plan['operations'][key]
+      deps[key] = [barrier] if barrier != None else []
+    barrier = f'stage:{stage}'
+    nodes[barrier] = None
+    deps[barrier] = keys
+  return nodes, deps
+
+def applyPlan(dryrun, plan, idToken, workers = 1, journal = None):
+  """
+  Apply the operations of a plan without reading the tenant again. Stages run
+  one after the other, the operations of a stage on up to `workers` threads.
+  Stages after a failed operation are skipped. Operations completed in the
+  `journal` are skipped, new ones are recorded in it.
+  """
+  logging.debug(f'Apply plan {plan["id"]}: {len(plan["operations"])} operations, workers: {workers}')
+  nodes, deps = planGraph(plan)
+
+  def run(key, operation):
+    if operation == None:
+      return None
+    if journal != None and key in journal.completed:
+      logging.debug(f'Skip completed operation: {key}')
+      return None
+    output = applyOperation(dryrun, operation, idToken)
+    if journal != None:
+      journal.record(key)
+    return output
+
+  results, errors, skipped = runGraph(nodes, deps, run, workers)
+  skipped = [key for key in skipped if nodes[key] != None]
+  if len(errors) > 0:
+    raise Exception(f'Plan {plan["id"]}: {len(errors)} operations failed, {len(skipped)} skipped')
+  if journal != None:
+    journal.finish()
+  return results
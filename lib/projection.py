@@ -0,0 +1,58 @@
+# coding: utf-8
+
+import sys
+import functools
+
+
+@functools.lru_cache(maxsize=None)
+def projectionTree(fields):
+  """
+  Turn field paths, ex: ('id', 'rules.accessRoleIds'), into a tree of nested
+  dicts, None marking a field kept whole.
+  """
+  tree = {}
+  for field in fields:
+    node = tree
+    names = field.split('.')
+    for name in names[:-1]:
+      if node.get(name, {}) == None:
+        break
+      node = node.setdefault(name, {})
+    else:
+      node[names[-1]] = None
+  return tree
+
+def compact(value):
+  """
+  Lists of ids and other scalars become tuples and strings are interned, ids
+  repeated across objects share one copy. Lists of objects stay lists.
+  """
+  if isinstance(value, str):
+    return sys.intern(value)
+  if isinstance(value, list):
+    items = [compact(item) for item in value]
+    if any(isinstance(item, (dict, list)) for item in items):
+      return items
+    return tuple(items)
+  if isinstance(value, dict):
+    return {sys.intern(name): compact(item) for name, item in value.items()}
+  return value
+
+def projectTree(value, tree):
+  if tree == None:
+    return compact(value)
+  if isinstance(value, list):
+    return [projectTree(item, tree) for item in value]
+  if not isinstance(value, dict):
+    return value
+  return {name: projectTree(value[name], subtree) for name, subtree in tree.items() if name in value}
+
+def project(item, fields):
+  """
+  Keep only `fields` of an object, all of them when `fields` is None. A field is
+  a dotted path, lists on the path are projected element by element, ex:
+  'rules.accessRoleIds' keeps the roles of every rule. Kept values are compact.
+  """
+  if fields == None:
+    return item
+  return projectTree(item, projectionTree(tuple(fields)))
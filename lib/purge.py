@@ -4,15 +4,24 @@ import json
 import urllib
 import logging
 
-import requests
 import pydash
 
-from .common import API_HOST
+from .common import request
+from .common import getResource
+from .common import getResources
+from .common import runAsync
+from .records import Record
+from .common import getResourceAsync
+from .common import getResourcesAsync
+from .common import getResourcesByIdAsync
+from .common import lookupIdsAsync
 
 
 def updateResource(dryrun, id, idToken, url, data = None):
   logging.debug(f'Update: {url}, id: {id}, data: {data}')
   kwargs = {}
+  if isinstance(data, Record):
+    data = data.toJson()
   if data != None:
     data.pop('id')
     pydash.set_(kwargs, 'data', json.dumps(data))
@@ -27,11 +36,7 @@ def updateResource(dryrun, id, idToken, url, data = None):
 
   quotedId = urllib.parse.quote(id)
   url = f'{url}/{quotedId}'
-  resp = requests.put(
-    f'{API_HOST}{url}',
-    headers={'content-type': 'application/json', 'idToken': idToken},
-    **kwargs,
-  )
+  resp = request('PUT', url, idToken=idToken, **kwargs)
   output = resp.status_code
   return output
 
@@ -51,10 +56,12 @@ def purgeResource(dryrun, id, idToken, url, data = None):
 
   quotedId = urllib.parse.quote(id)
   url = f'{url}/{quotedId}'
-  resp = requests.delete(
-    f'{API_HOST}{url}',
-    headers={'content-type': 'application/json', 'idToken': idToken},
-    **kwargs,
-  )
+  resp = request('DELETE', url, idToken=idToken, **kwargs)
   output = resp.status_code
   return output
+
+async def updateResourceAsync(dryrun, id, idToken, url, data = None):
+  return await runAsync(updateResource, dryrun, id=id, idToken=idToken, url=url, data=data)
+
+async def purgeResourceAsync(dryrun, id, idToken, url, data = None):
+  return await runAsync(purgeResource, dryrun, id=id, idToken=idToken, url=url, data=data)
@@ -0,0 +1,81 @@
+# coding: utf-8
+
+import os
+import time
+import logging
+import threading
+
+# NOTE: requests per second for the whole process, 0 disables the limiter
+API_RATE_LIMIT = float(os.getenv('API_RATE_LIMIT', '0'))
+API_RATE_BURST = int(os.getenv('API_RATE_BURST', '0'))
+# NOTE: per endpoint limits, ex: "/api/v1/policies=5:10,/api/v1/users=2"
+API_RATE_LIMITS = os.getenv('API_RATE_LIMITS', '')
+
+
+class TokenBucket:
+  """
+  Token bucket refilled at `rate` tokens per second up to `burst` tokens. Callers
+  reserve a token and sleep until it is due, so waiting threads are served in order.
+  """
+
+  def __init__(self, rate, burst=None):
+    self.rate = float(rate)
+    self.burst = float(burst or max(1, rate))
+    self.tokens = self.burst
+    self.updated = time.monotonic()
+    self.lock = threading.Lock()
+
+  def acquire(self):
+    with self.lock:
+      now = time.monotonic()
+      self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+      self.updated = now
+      self.tokens -= 1
+      delay = 0 if self.tokens >= 0 else -self.tokens / self.rate
+    if delay > 0:
+      time.sleep(delay)
+    return delay
+
+
+_buckets = {}
+_bucketsLock = threading.Lock()
+
+def setRateLimit(rate, burst=None, endpoint=None):
+  """
+  Limit requests to `rate` per second with bursts of `burst`. Without `endpoint`
+  the limit applies to every request, otherwise to urls starting with `endpoint`
+  (ex: POLICY_API) on top of the process-wide one. A rate of 0 removes the limit.
+  """
+  with _bucketsLock:
+    if not rate:
+      _buckets.pop(endpoint, None)
+    else:
+      _buckets[endpoint] = TokenBucket(rate, burst)
+
+def acquireRateLimit(url):
+  """
+  Block until `url` may be requested under the process-wide and endpoint limits.
+  """
+  buckets = [_buckets.get(None)]
+  endpoints = [endpoint for endpoint in _buckets if endpoint != None and url.startswith(endpoint)]
+  if len(endpoints) > 0:
+    buckets.append(_buckets[max(endpoints, key=len)])
+  for bucket in buckets:
+    if bucket != None:
+      delay = bucket.acquire()
+      if delay > 0:
+        logging.debug(f'Rate limited: {url}, waited {delay:.3f}s')
+
+def parseRateLimits(spec):
+  limits = []
+  for item in filter(None, [item.strip() for item in spec.split(',')]):
+    endpoint, limit = item.split('=', 1)
+    rate, _, burst = limit.partition(':')
+    limits.append((endpoint.strip(), float(rate), int(burst) if burst else None))
+  return limits
+
+
+if API_RATE_LIMIT > 0:
+  setRateLimit(API_RATE_LIMIT, API_RATE_BURST or None)
+for endpoint, rate, burst in parseRateLimits(API_RATE_LIMITS):
+  setRateLimit(rate, burst, endpoint=endpoint)
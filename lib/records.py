@@ -0,0 +1,144 @@
+# coding: utf-8
+
+import sys
+
+
+def intern(value):
+  return sys.intern(value) if isinstance(value, str) else value
+
+
+class Record:
+  """
+  Slot based image of an API object. IDS are interned strings, LISTS tuples of
+  interned ids and RECORDS tuples of nested records. Fields without a slot, and
+  slot fields read as null, are kept in `extra`, so toJson gives back the
+  object that was read.
+  """
+  __slots__ = ('extra',)
+  IDS = ()
+  LISTS = ()
+  RECORDS = ()
+
+  def __init__(self, **fields):
+    # NOTE: a slot left None is a missing field, one read as null stays in `extra`
+    nulls = {}
+    for name in self.IDS:
+      if name in fields and fields[name] == None:
+        nulls[name] = None
+      value = fields.pop(name, None)
+      setattr(self, name, intern(value))
+    for name in self.LISTS:
+      if name in fields and fields[name] == None:
+        nulls[name] = None
+      value = fields.pop(name, None)
+      setattr(self, name, tuple(intern(item) for item in value) if value != None else None)
+    for name, recordType in self.RECORDS:
+      if name in fields and fields[name] == None:
+        nulls[name] = None
+      value = fields.pop(name, None)
+      setattr(self, name, tuple(recordType.fromJson(item) for item in value) if value != None else None)
+    fields.update(nulls)
+    self.extra = fields or None
+
+  @classmethod
+  def fromJson(cls, data):
+    if isinstance(data, cls):
+      return data
+    return cls(**data)
+
+  def toJson(self, exclude=()):
+    """
+    Fields set on the record but `exclude`, ex: a field missing from the API
+    object stays missing. Values of `extra` are shared with the record, not
+    copied.
+    """
+    output = {}
+    for name in self.IDS:
+      value = getattr(self, name)
+      if value != None and name not in exclude:
+        output[name] = value
+    for name in self.LISTS:
+      value = getattr(self, name)
+      if value != None and name not in exclude:
+        output[name] = list(value)
+    for name, _ in self.RECORDS:
+      value = getattr(self, name)
+      if value != None and name not in exclude:
+        output[name] = [record.toJson() for record in value]
+    if self.extra != None:
+      for name, value in self.extra.items():
+        if name not in exclude and name not in output:
+          output[name] = value
+    return output
+
+  def __repr__(self):
+    return f'{type(self).__name__}({self.toJson()})'
+
+
+class User(Record):
+  __slots__ = ('id', 'email', 'name', 'teamIds', 'accessRoleIds')
+  IDS = ('id', 'email', 'name')
+  LISTS = ('teamIds', 'accessRoleIds')
+
+class Team(Record):
+  __slots__ = ('id', 'name', 'emails', 'accessRoleIds')
+  IDS = ('id', 'name')
+  LISTS = ('emails', 'accessRoleIds')
+
+class Role(Record):
+  __slots__ = ('id', 'name', 'emails', 'teamIds')
+  IDS = ('id', 'name')
+  LISTS = ('emails', 'teamIds')
+
+class Rule(Record):
+  __slots__ = ('accessRoleIds',)
+  LISTS = ('accessRoleIds',)
+
+class Policy(Record):
+  __slots__ = ('id', 'name', 'rules')
+  IDS = ('id', 'name')
+  RECORDS = (('rules', Rule),)
+
+class App(Record):
+  __slots__ = ('id', 'name', 'policyId')
+  IDS = ('id', 'name', 'policyId')
+
+class Network(Record):
+  __slots__ = ('id', 'name')
+  IDS = ('id', 'name')
+
+
+class PolicyPatch:
+  """
+  Copy on write rewrite of a Policy record. Only the roles of the rules that
+  change are recorded, the policy itself is left untouched and the payload is
+  built once, by toJson, for the policies that are really updated.
+  """
+  __slots__ = ('policy', 'ruleRoleIds')
+
+  def __init__(self, policy):
+    self.policy = policy
+    # NOTE: rule index -> remaining roles
+    self.ruleRoleIds = {}
+
+  def setRuleRoles(self, ruleIdx, roleIds):
+    self.ruleRoleIds[ruleIdx] = tuple(roleIds)
+
+  def toJson(self):
+    """
+    The update payload: the policy with the patched roles, rules left without
+    roles are dropped. Untouched rules are sent as they were read, only the
+    patched ones are built anew.
+    """
+    output = self.policy.toJson(exclude=('rules',))
+    rules = []
+    for ruleIdx, rule in enumerate(self.policy.rules or ()):
+      roleIds = self.ruleRoleIds.get(ruleIdx, rule.accessRoleIds) or ()
+      if len(roleIds) == 0:
+        continue
+      ruleOutput = rule.toJson()
+      if ruleIdx in self.ruleRoleIds:
+        ruleOutput['accessRoleIds'] = list(roleIds)
+      rules.append(ruleOutput)
+    output['rules'] = rules
+    return output
@@ -0,0 +1,129 @@
+# coding: utf-8
+
+import os
+import time
+import random
+import logging
+import threading
+import collections
+import email.utils
+
+import requests
+from retrying import Retrying
+from retrying import RetryError
+
+API_RETRY_ATTEMPTS = int(os.getenv('API_RETRY_ATTEMPTS', '5'))
+# NOTE: backoff before retry n is a random delay up to API_RETRY_BACKOFF * 2^(n-1) seconds
+API_RETRY_BACKOFF = float(os.getenv('API_RETRY_BACKOFF', '0.5'))
+API_RETRY_BACKOFF_MAX = float(os.getenv('API_RETRY_BACKOFF_MAX', '30'))
+API_RETRY_STATUSES = {429, 500, 502, 503, 504}
+# NOTE: only requests that are safe to send twice are retried unless the caller says so
+API_RETRY_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+
+_stats = collections.Counter()
+_statsLock = threading.Lock()
+
+
+def countRetry(key):
+  with _statsLock:
+    _stats[key] += 1
+
+def getRetryStats():
+  """
+  Return the retry counters of this process: `requests` sent through the retry
+  policy, `retries` in total and per cause, and `exhausted` requests that failed
+  after the last attempt.
+  """
+  with _statsLock:
+    return dict(_stats)
+
+def resetRetryStats():
+  with _statsLock:
+    _stats.clear()
+
+def retryAfter(resp):
+  """
+  Seconds asked for by a Retry-After header, either delay-seconds or an HTTP date.
+  """
+  value = None if resp == None else resp.headers.get('Retry-After')
+  if value == None:
+    return None
+  try:
+    return max(0.0, float(value))
+  except ValueError:
+    pass
+  try:
+    return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+  except (TypeError, ValueError):
+    return None
+
+def isTransientError(e):
+  return isinstance(e, (requests.ConnectionError, requests.Timeout))
+
+def isTransientResponse(resp):
+  return resp.status_code in API_RETRY_STATUSES
+
+def sendWithRetry(method, send, retry=None):
+  """
+  Call `send()` until it returns a response that is not transient, with
+  exponential backoff and full jitter between attempts. Idempotent methods are
+  retried by default, `retry` forces it on or off. The last response is returned
+  when attempts run out or the server asks to wait longer than
+  API_RETRY_BACKOFF_MAX, the last connection error is raised.
+  """
+  if retry == None:
+    retry = method.upper() in API_RETRY_METHODS
+  if not retry or API_RETRY_ATTEMPTS <= 1:
+    return send()
+
+  countRetry('requests')
+  last = {'resp': None, 'cause': None}
+
+  def attempt():
+    if last['resp'] != None:
+      # NOTE: release the connection of the failed attempt, a streamed body holds it until collected
+      last['resp'].close()
+    last['resp'] = None
+    try:
+      resp = send()
+    except Exception as e:
+      last['cause'] = type(e).__name__
+      raise
+    last['resp'] = resp
+    last['cause'] = str(resp.status_code)
+    return resp
+
+  def stop(attemptNumber, delaySinceFirstAttemptMs):
+    if attemptNumber >= API_RETRY_ATTEMPTS:
+      return True
+    requested = retryAfter(last['resp'])
+    if requested != None and requested > API_RETRY_BACKOFF_MAX:
+      logging.debug(f'Give up {method} after {last["cause"]}: Retry-After {requested:.0f}s is above {API_RETRY_BACKOFF_MAX:.0f}s')
+      return True
+    return False
+
+  def wait(attemptNumber, delaySinceFirstAttemptMs):
+    delay = random.uniform(0, min(API_RETRY_BACKOFF_MAX, API_RETRY_BACKOFF * 2 ** (attemptNumber - 1)))
+    requested = retryAfter(last['resp'])
+    if requested != None:
+      delay = max(delay, requested)
+    countRetry('retries')
+    countRetry(f'retries:{last["cause"]}')
+    logging.debug(f'Retry {method} after {last["cause"]} in {delay:.2f}s')
+    return delay * 1000
+
+  retrier = Retrying(
+    stop_func=stop,
+    wait_func=wait,
+    retry_on_exception=isTransientError,
+    retry_on_result=isTransientResponse,
+  )
+  try:
+    return retrier.call(attempt)
+  except RetryError as e:
+    countRetry('exhausted')
+    return e.last_attempt.value
+  except Exception as e:
+    if isTransientError(e):
+      countRetry('exhausted')
+    raise
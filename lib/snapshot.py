@@ -0,0 +1,127 @@
+# coding: utf-8
+
+import os
+import json
+import time
+import sqlite3
+import logging
+
+from .tokencache import CACHE_DIR
+
+# NOTE: serve getResources from the local snapshot, off by default
+API_SNAPSHOT = os.getenv('API_SNAPSHOT', 'false').lower() in {'true', 't', 'yes', 'y'}
+API_SNAPSHOT_TTL = int(os.getenv('API_SNAPSHOT_TTL', '300'))
+# NOTE: per collection lifetime in seconds, ex: "/api/v1/networks=3600,/api/v1/policies=60"
+API_SNAPSHOT_TTLS = os.getenv('API_SNAPSHOT_TTLS', '')
+API_SNAPSHOT_PATH = os.getenv('API_SNAPSHOT_PATH', os.path.join(CACHE_DIR, 'snapshot.sqlite3'))
+
+_settings = {
+  'enabled': API_SNAPSHOT,
+  'refresh': False,
+  'ttls': {},
+}
+# NOTE: collections already refreshed by this process when `refresh` is set
+_refreshed = set()
+
+
+def parseTtls(spec):
+  ttls = {}
+  for item in filter(None, [item.strip() for item in spec.split(',')]):
+    url, ttl = item.split('=', 1)
+    ttls[url.strip()] = int(ttl)
+  return ttls
+
+def configureSnapshot(enabled=None, refresh=None, ttls=None):
+  """
+  Turn the snapshot on or off. With `refresh` every collection is read from the
+  API once more in this process and the snapshot updated, `ttls` maps collection
+  urls to their lifetime in seconds.
+  """
+  if enabled != None:
+    _settings['enabled'] = enabled
+  if refresh != None:
+    _settings['refresh'] = refresh
+    _refreshed.clear()
+  if ttls != None:
+    _settings['ttls'].update(ttls)
+
+def snapshotEnabled():
+  return _settings['enabled']
+
+def snapshotTtl(url):
+  return _settings['ttls'].get(url, API_SNAPSHOT_TTL)
+
+def connect():
+  os.makedirs(os.path.dirname(API_SNAPSHOT_PATH), mode=0o700, exist_ok=True)
+  db = sqlite3.connect(API_SNAPSHOT_PATH, timeout=30)
+  db.execute('''
+    CREATE TABLE IF NOT EXISTS collections (
+      host TEXT NOT NULL,
+      tenant TEXT NOT NULL,
+      url TEXT NOT NULL,
+      fetchedAt REAL NOT NULL,
+      body TEXT NOT NULL,
+      PRIMARY KEY (host, tenant, url)
+    )''')
+  return db
+
+def readSnapshot(host, tenant, url):
+  """
+  Return the stored collection when it is younger than its TTL, None otherwise.
+  """
+  if not _settings['enabled']:
+    return None
+  if _settings['refresh'] and url not in _refreshed:
+    return None
+  db = connect()
+  try:
+    row = db.execute(
+      'SELECT fetchedAt, body FROM collections WHERE host = ? AND tenant = ? AND url = ?',
+      (host, tenant, url),
+    ).fetchone()
+  finally:
+    db.close()
+  if row == None:
+    return None
+  fetchedAt, body = row
+  age = time.time() - fetchedAt
+  if age > snapshotTtl(url):
+    logging.debug(f'Snapshot expired: {url}, age: {age:.0f}s')
+    return None
+  logging.debug(f'Read snapshot: {url}, age: {age:.0f}s')
+  return json.loads(body)
+
+def writeSnapshot(host, tenant, url, output):
+  if not _settings['enabled']:
+    return
+  _refreshed.add(url)
+  db = connect()
+  try:
+    with db:
+      db.execute(
+        'INSERT OR REPLACE INTO collections (host, tenant, url, fetchedAt, body) VALUES (?, ?, ?, ?, ?)',
+        (host, tenant, url, time.time(), json.dumps(output)),
+      )
+  finally:
+    db.close()
+
+def dropSnapshot(host, tenant, urls):
+  """
+  Forget the stored collections the `urls` belong to, after they were changed.
+  The snapshot may be shared with processes that have it enabled, so it is
+  dropped whenever it exists, enabled here or not.
+  """
+  if not os.path.exists(API_SNAPSHOT_PATH):
+    return
+  db = connect()
+  try:
+    with db:
+      db.executemany(
+        'DELETE FROM collections WHERE host = ? AND tenant = ? AND (url = ? OR ? LIKE url || \'/%\')',
+        [(host, tenant, url, url) for url in urls],
+      )
+  finally:
+    db.close()
+
+
+configureSnapshot(ttls=parseTtls(API_SNAPSHOT_TTLS))
@@ -0,0 +1,75 @@
+# coding: utf-8
+
+import os
+import json
+import time
+import base64
+import hashlib
+import logging
+
+import appdirs
+
+API_TOKEN_CACHE = os.getenv('API_TOKEN_CACHE', 'true').lower() in {'true', 't', 'yes', 'y'}
+# NOTE: lifetime assumed for tokens that carry no expiry claim
+API_TOKEN_TTL = int(os.getenv('API_TOKEN_TTL', '3600'))
+# NOTE: tokens this close to expiry are not reused
+API_TOKEN_REFRESH_MARGIN = int(os.getenv('API_TOKEN_REFRESH_MARGIN', '300'))
+
+CACHE_DIR = appdirs.user_cache_dir('appaegis-api')
+
+
+def tokenCachePath(host, apiKey):
+  digest = hashlib.sha256(f'{host}\n{apiKey}'.encode('utf-8')).hexdigest()
+  return os.path.join(CACHE_DIR, 'tokens', f'{digest}.json')
+
+def tokenExpiry(token, default=None):
+  """
+  Read the `exp` claim of a JWT token without verifying it, `default` otherwise.
+  """
+  parts = str(token).split(' ')[-1].split('.')
+  if len(parts) != 3:
+    return default
+  try:
+    payload = parts[1] + '=' * (-len(parts[1]) % 4)
+    claims = json.loads(base64.urlsafe_b64decode(payload))
+    return float(claims['exp'])
+  except (ValueError, KeyError, TypeError):
+    return default
+
+def readCachedToken(host, apiKey):
+  """
+  Return the cached `{'token', 'expiresAt'}` entry, None when missing or expiring.
+  """
+  if not API_TOKEN_CACHE:
+    return None
+  path = tokenCachePath(host, apiKey)
+  try:
+    with open(path, 'r') as f:
+      entry = json.load(f)
+  except (OSError, ValueError):
+    return None
+  if entry.get('expiresAt', 0) - API_TOKEN_REFRESH_MARGIN <= time.time():
+    logging.debug(f'Cached token expired: {path}')
+    return None
+  logging.debug(f'Reuse cached token: {path}')
+  return entry
+
+def writeCachedToken(host, apiKey, entry):
+  if not API_TOKEN_CACHE:
+    return
+  path = tokenCachePath(host, apiKey)
+  try:
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    tmpPath = f'{path}.{os.getpid()}.tmp'
+    fd = os.open(tmpPath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+      json.dump(entry, f)
+    os.replace(tmpPath, path)
+  except OSError as e:
+    logging.debug(f'Cannot cache token: {e}')
+
+def dropCachedToken(host, apiKey):
+  try:
+    os.remove(tokenCachePath(host, apiKey))
+  except OSError:
+    pass
@@ -15,7 +15,11 @@ from lib.common import argString
 
 from lib.common import getToken
 from lib.common import getResources
-from lib.common import getResource
+from lib.common import iterResources
+from lib.common import lookupIds
+from lib.records import Network
+from lib.snapshot import API_SNAPSHOT
+from lib.snapshot import configureSnapshot
 
 
 def main(argsdict):
@@ -23,24 +27,31 @@ def main(argsdict):
   nwname = argsdict.get('nwname')
   if debug:
     logging.getLogger().setLevel(logging.DEBUG)
+  configureSnapshot(enabled=argsdict.get('cache'), refresh=argsdict.get('refresh'))
 
   idToken = getToken(apiSecret=API_SECRET, apiKey=API_KEY)
-  networks = getResources(
-    idToken=idToken,
-    url=NETWORKS_API,
-  )
 
   if not bool(nwname):
+    networks = getResources(
+      idToken=idToken,
+      url=NETWORKS_API,
+    )
     pprint.pprint(networks)
   else:
-    for nw in networks:
-      if str(nw.get('name')) == nwname:
-        nw = getResource(
-          id=nw['id'],
-          idToken=idToken,
-          url=NETWORKS_API,
-        )
-        pprint.pprint(nw)
+    networks = iterResources(
+      idToken=idToken,
+      url=NETWORKS_API,
+      fields=['id', 'name'],
+    )
+    ids = [nw.id for nw in map(Network.fromJson, networks) if str(nw.name) == nwname]
+    found = lookupIds(
+      ids,
+      idToken=idToken,
+      url=NETWORKS_API,
+    )
+    for id in ids:
+      if id in found:
+        pprint.pprint(found[id])
 
 
 
@@ -50,5 +61,9 @@ if __name__ == '__main__':
                       required=False, help='Output verbose log')
   parser.add_argument('--nwname', dest='nwname', type=argString, default=False,
                       required=False, help='Output verbose log')
+  parser.add_argument('--cache', dest='cache', type=booleanString, default=API_SNAPSHOT,
+                      required=False, help='Read the networks from the local snapshot while it is fresh')
+  parser.add_argument('--refresh', dest='refresh', type=booleanString, default=False,
+                      required=False, help='Read the networks from the API and update the local snapshot')
   args = parser.parse_args()
   main(vars(args))
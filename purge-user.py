@@ -1,189 +1,130 @@
 #!/usr/bin/env python
 # coding: utf-8
 
+import sys
+import asyncio
 import logging
 import argparse
 
-import pydash
-
 from lib.common import USER_EMAIL
 from lib.common import API_KEY
 from lib.common import API_SECRET
 from lib.common import USER_API
-from lib.common import TEAM_API
-from lib.common import ROLE_API
-from lib.common import POLICY_API
-from lib.common import APP_API
+from lib.common import API_HOST
 
 from lib.common import getToken
 from lib.common import booleanString
-from lib.purge import getResource
-from lib.purge import getResources
-from lib.purge import updateResource
-from lib.purge import purgeResource
-
+from lib.common import argString
+from lib.common import API_CONCURRENCY
+from lib.common import findResourceAsync
+from lib.graph import loadTenantGraphAsync
+from lib.graph import GRAPH_FIELDS
+from lib.records import User
+from lib.plan import planPurge
+from lib.plan import applyPlan
+from lib.plan import writePlan
+from lib.plan import readPlan
+from lib.plan import checkPlanAge
+from lib.plan import API_PLAN_MAX_AGE
+from lib.journal import Journal
+from lib.journal import storePlan
+from lib.journal import unfinishedPlan
+from lib.retry import getRetryStats
+from lib.snapshot import API_SNAPSHOT
+from lib.snapshot import configureSnapshot
+
+
+def readEmails(path):
+  """
+  Read one email per line from `path`, `-` reads stdin. Blank lines and lines
+  starting with `#` are skipped.
+  """
+  f = sys.stdin if path == '-' else open(path, 'r')
+  try:
+    lines = [line.strip() for line in f]
+  finally:
+    if f != sys.stdin:
+      f.close()
+  return list(dict.fromkeys([line for line in lines if bool(line) and not line.startswith('#')]))
+
+async def fetchTenant(emails, idToken):
+  """
+  Read the users to remove one by one, concurrently, and every app, policy,
+  team and role of the tenant once. Unknown users are skipped.
+  """
+  # NOTE: the purge follows the teams and roles of each user, read the whole user, not a lookup summary
+  outputs = await asyncio.gather(*[findResourceAsync(id=email, idToken=idToken, url=USER_API, fields=GRAPH_FIELDS['users']) for email in emails])
+  users = {}
+  for email, output in zip(emails, outputs):
+    if output == None:
+      logging.error(f'Skip user: {email}, not found')
+    else:
+      users[email] = User.fromJson(output)
+  graph = await loadTenantGraphAsync(idToken, users=list(users.values()))
+  return users, graph
+
+def applyWithJournal(dryrun, plan, idToken, workers, resume):
+  """
+  Apply the plan and journal every completed operation, so a run that stopped
+  midway resumes where it stopped. Dry runs are not journaled.
+  """
+  journal = None
+  if dryrun != True:
+    journal = Journal(plan['runId'], reset=not resume)
+    if journal.done:
+      logging.warning(f'Plan {plan["id"]}, run {plan["runId"]} was already applied')
+      journal.close()
+      return
+  try:
+    applyPlan(dryrun, plan, idToken, workers=workers, journal=journal)
+  finally:
+    if journal != None:
+      journal.close()
+  logging.debug(f'Retry stats: {getRetryStats()}')
 
 def main(argsdict):
   dryrun = argsdict.get('dryrun')
   debug = argsdict.get('debug')
+  emailsPath = argsdict.get('emails')
+  planPath = argsdict.get('plan')
+  applyPath = argsdict.get('apply')
+  resume = argsdict.get('resume')
+  workers = argsdict.get('workers')
   if debug:
     logging.getLogger().setLevel(logging.DEBUG)
-  userId = USER_EMAIL
-  logging.warning(f'Remove user: {userId}, Dryrun: {dryrun}')
   idToken = getToken(apiSecret=API_SECRET, apiKey=API_KEY)
-  user = getResource(id=userId, idToken=idToken, url=USER_API)
-
-  # TODO: check the team contains only this user
-  #       also need to skip "groups"
-  teamIds = user.get('teamIds', [])
-  accessRoleIds = user.get('accessRoleIds')
-
-  # NOTE: Fetch all apps and related policyId
-  policyAppMapper = {}
-  apps = getResources(idToken=idToken, url=APP_API)
-  for app in apps:
-    appId = app.get('id')
-    policyId = app.get('policyId')
-    # policy exists
-    if bool(policyId):
-      appIds = pydash.get(policyAppMapper, f'{policyId}.appId', [])
-      appIds.append(appId)
-      pydash.set_(policyAppMapper, f'{policyId}.appId', appIds)
-
-  # NOTE: Check each policy if it's deletable or not. It only handles ruleRoleLink except Role
-  policyIds = list(policyAppMapper.keys())
-  for policyId in policyIds:
-    policyRoleIds = []
-    policy = getResource(id=policyId, idToken=idToken, url=POLICY_API)
-    rules = pydash.objects.get(policy, 'rules')
-    for rule in rules:
-      roleIds = pydash.objects.get(rule, 'accessRoleIds')
-      policyRoleIds.append(roleIds)
-    policyRoleIds = pydash.flatten_deep(policyRoleIds)
-    # NOTE: In case the policyRoleIds is totally equal with userRoleIds, we will delete it.
-    if set(policyRoleIds) <= set(accessRoleIds):
-      pydash.set_(policyAppMapper, f'{policyId}.deletable', True)
-    else:
-      pydash.set_(policyAppMapper, f'{policyId}.deletable', False)
-
-  deletablePolicyMapper = pydash.pick_by(policyAppMapper, lambda item: pydash.get(item, 'deletable') == True)
-  deletablePolicyIds = list(deletablePolicyMapper.keys())
-  deletableAppIds = pydash.flatten_deep([pydash.get(deletablePolicyMapper, f'{i}.appId') for i in deletablePolicyMapper])
-
-  # NOTE: delete app if its policy will be deleted.
-  for appId in deletableAppIds:
-    purgeResource(dryrun, id=appId, idToken=idToken, url=APP_API)
-
-  # NOTE: delete policy something like policyEntry, policyRole relationship and ruleEntry
-  for policyId in deletablePolicyIds:
-    purgeResource(dryrun, id=policyId, idToken=idToken, url=POLICY_API)
-  
-  # NOTE: remove relationship something like userTeamLink, userRoleLink, teamRoleLink.
-  for teamId in teamIds:
-    purgeResource(dryrun, id=teamId, idToken=idToken, url=f'{TEAM_API}/{teamId}/users/', data=[userId])
-  for roleId in accessRoleIds:
-    purgeResource(dryrun, id=roleId, idToken=idToken, url=f'{ROLE_API}/{roleId}/users/', data=[userId])
-    purgeResource(dryrun, id=roleId, idToken=idToken, url=f'{ROLE_API}/{roleId}/teams/', data=teamIds)
-
-  # NOTE: remove teams
-  deletableTeamIds = []
-  for teamId in teamIds:
-    team = getResource(id=teamId, idToken=idToken, url=TEAM_API)
-    teamEmails = pydash.get(team, 'emails')
-    teamRoleIds = pydash.get(team, 'accessRoleIds')
-    # NOTE: check the role contains only this user and teams
-    if len(set(teamEmails) - set([userId])) == 0 and len(set(teamRoleIds) - set(accessRoleIds)) == 0:
-      deletableTeamIds.append(teamId)
-
-  # NOTE: remove roles
-  deletableRoleIds = []
-  for roleId in accessRoleIds:
-    role = getResource(id=roleId, idToken=idToken, url=ROLE_API)
-    roleEmails = pydash.get(role, 'emails')
-    roleTeamIds = pydash.get(role, 'teamIds')
-    # NOTE: check the role contains only this user and teams
-    if len(set(roleEmails) - set([userId])) == 0 and len(set(roleTeamIds) - set(teamIds)) == 0:
-      deletableRoleIds.append(roleId)
-
-  for teamId in deletableTeamIds:
-    purgeResource(dryrun, id=teamId, idToken=idToken, url=TEAM_API)
-  for roleId in deletableRoleIds:
-    purgeResource(dryrun, id=roleId, idToken=idToken, url=ROLE_API)
-
-  # NOTE: handle orphan policy once app was deleted before
-  updatablePolicyDataSet = {}
-  deletablePolicyIds = {}
-  policies = getResources(idToken=idToken, url=POLICY_API)
-  for policy in policies:
-    policyId = policy.get('id')
-    policyRoleIds = []
-    rules = pydash.objects.get(policy, 'rules')
-    for ruleIdx, rule in enumerate(rules):
-      ruleRoleIds = rule.get('accessRoleIds')
-      policyRoleIds.append(ruleRoleIds)
-
-      # NOTE: Handle the detail Configure policy
-      remainingRuleRoleIds = set(ruleRoleIds) - set(accessRoleIds)
-      remainingRuleRoleIds = list(remainingRuleRoleIds)
-      if len(remainingRuleRoleIds) > 0 and len(ruleRoleIds) != len(remainingRuleRoleIds):
-        newPolicy = pydash.get(updatablePolicyDataSet, policyId, pydash.clone_deep(policy))
-        pydash.set_(newPolicy, f'rules.{ruleIdx}.accessRoleIds', remainingRuleRoleIds)
-        pydash.set_(updatablePolicyDataSet, policyId, newPolicy)
-      elif len(remainingRuleRoleIds) == 0:
-        newPolicy = pydash.get(updatablePolicyDataSet, policyId, pydash.clone_deep(policy))
-        pydash.set_(newPolicy, f'rules.{ruleIdx}.accessRoleIds', [])
-        pydash.set_(updatablePolicyDataSet, policyId, newPolicy)
-
-    policyRoleIds = pydash.flatten_deep(policyRoleIds)
-    # NOTE: In case the policyRoleIds is totally equal with userRoleIds, we will delete it.
-    if set(policyRoleIds) <= set(accessRoleIds):
-      pydash.set_(deletablePolicyIds, policyId, policy)
-    elif len(policyRoleIds) == 0:
-      # NOTE: Relationship was removed previously
-      pydash.set_(deletablePolicyIds, policyId, policy)
-
-  # NOTE: Handle Configure policy
-  for policyId in updatablePolicyDataSet:
-    policy = pydash.get(updatablePolicyDataSet, policyId)
-    if pydash.get(deletablePolicyIds, policyId, None) != None:
-      continue
-    rules = policy.get('rules', [])
-    newRules = [rule for rule in rules if len(rule.get('accessRoleIds', [])) > 0]
-    pydash.set_(policy, 'rules', newRules)
-    updateResource(dryrun, id=policyId, idToken=idToken, url=POLICY_API, data = policy)
-
-  for policyId in deletablePolicyIds:
-    purgeResource(dryrun, id=policyId, idToken=idToken, url=POLICY_API)
-
-  # NOTE: handle orphan team once app was deleted before
-  orphanTeamIds = []
-  teams = getResources(idToken=idToken, url=TEAM_API)
-  for team in teams:
-    teamId = team.get('id')
-    teamEmails = pydash.get(team, 'emails')
-    if teamEmails == [userId]:
-      # NOTE: Other case will be hanlded by user deleting
-      orphanTeamIds.append(teamId)
-  for teamId in orphanTeamIds:
-    purgeResource(dryrun, id=teamId, idToken=idToken, url=f'{TEAM_API}/{teamId}/users/', data=[userId])
-
-  # NOTE: handle orphan role once app was deleted before
-  orphanRoleIds = []
-  roles = getResources(idToken=idToken, url=ROLE_API)
-  for role in roles:
-    roleId = role.get('id')
-    roleEmails = pydash.get(role, 'emails')
-    roleTeamIds = pydash.get(role, 'teamIds')
-    # NOTE: skip this team including others relationship
-    if roleEmails == [userId] and len(set(roleTeamIds) - set(teamIds)) == 0:
-      orphanRoleIds.append(roleId)
-  for roleId in orphanRoleIds:
-    purgeResource(dryrun, id=roleId, idToken=idToken, url=ROLE_API)
 
-  # NOTE: remove userEntry, and his relationship team, rule link, etc
-  # TODO: check the team contains only this user
-  #       also need to skip "groups"
-  purgeResource(dryrun, id=userId, idToken=idToken,  url=USER_API)
+  # NOTE: apply a saved plan without reading the tenant again
+  if bool(applyPath):
+    plan = readPlan(applyPath)
+    if dryrun != True:
+      checkPlanAge(plan, argsdict.get('maxAge'))
+    logging.warning(f'Apply plan {plan["id"]}: {", ".join(plan["emails"])}, Dryrun: {dryrun}')
+    applyWithJournal(dryrun, plan, idToken, workers, resume)
+    return
+
+  # NOTE: only a dry run may rely on the snapshot, a purge or a saved plan reads the live tenant
+  configureSnapshot(enabled=argsdict.get('cache'), refresh=argsdict.get('refresh') or dryrun != True or bool(planPath))
+  emails = readEmails(emailsPath) if bool(emailsPath) else [USER_EMAIL]
+  logging.warning(f'Remove users: {", ".join(emails)}, Dryrun: {dryrun}')
+
+  # NOTE: an interrupted purge of the same users resumes its plan instead of
+  #       reading the half purged tenant again
+  plan = None
+  if dryrun != True and not bool(planPath) and resume:
+    plan = unfinishedPlan(API_HOST, emails)
+  if plan == None:
+    users, graph = asyncio.run(fetchTenant(emails, idToken))
+    if len(users) == 0:
+      logging.error('No user to remove')
+      return
+    plan = planPurge(users, graph)
+    if bool(planPath):
+      writePlan(plan, planPath)
+      return
+    if dryrun != True:
+      storePlan(plan, API_HOST, emails)
+  applyWithJournal(dryrun, plan, idToken, workers, resume)
 
 if __name__ == '__main__':
   parser = argparse.ArgumentParser(description='Remove existing user and associated objects')
@@ -191,6 +132,22 @@ if __name__ == '__main__':
                       required=True, help='In dryrun mode, no objects will be deleted')
   parser.add_argument('--debug', dest='debug', type=booleanString, default=False,
                       required=False, help='Output verbose log')
+  parser.add_argument('--emails', dest='emails', type=argString, default=None,
+                      required=False, help='File with one email per line to remove in one run, - reads stdin. Defaults to USER_EMAIL')
+  parser.add_argument('--cache', dest='cache', type=booleanString, default=API_SNAPSHOT,
+                      required=False, help='In dryrun mode, read the tenant from the local snapshot while it is fresh')
+  parser.add_argument('--refresh', dest='refresh', type=booleanString, default=False,
+                      required=False, help='Read the tenant from the API and update the local snapshot')
+  parser.add_argument('--plan', dest='plan', type=argString, default=None,
+                      required=False, help='Only compute the purge and save the plan to this file (.json, or .msgpack)')
+  parser.add_argument('--apply', dest='apply', type=argString, default=None,
+                      required=False, help='Apply a plan saved with --plan instead of reading the tenant')
+  parser.add_argument('--max-age', dest='maxAge', type=int, default=API_PLAN_MAX_AGE,
+                      required=False, help='Seconds after its computation a plan given to --apply may still be applied, 0 applies any plan')
+  parser.add_argument('--workers', dest='workers', type=int, default=API_CONCURRENCY,
+                      required=False, help='Number of independent deletes and updates run at the same time')
+  parser.add_argument('--resume', dest='resume', type=booleanString, default=True,
+                      required=False, help='Resume an interrupted purge of the same users or plan, False starts over')
 
   args = parser.parse_args()
   main(vars(args))